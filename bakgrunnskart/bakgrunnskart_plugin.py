@@ -1,53 +1,90 @@
 # -*- coding: utf-8 -*-
 
-from qgis.PyQt.QtCore import QCoreApplication, Qt, QSize
-from qgis.PyQt.QtGui import QIcon, QPixmap, QPalette
+from qgis.PyQt.QtCore import (
+    QBuffer,
+    QCoreApplication,
+    QEvent,
+    Qt,
+    QSize,
+    QTimer,
+    QObject,
+    QRunnable,
+    QThreadPool,
+    QModelIndex,
+    QRect,
+    QSortFilterProxyModel,
+    QStandardPaths,
+    QThread,
+    QUrl,
+    pyqtSignal,
+    qVersion,
+)
+from qgis.PyQt.QtGui import (
+    QIcon,
+    QImage,
+    QImageReader,
+    QPixmap,
+    QPixmapCache,
+    QPalette,
+    QStandardItem,
+    QStandardItemModel,
+    QTextDocument,
+)
 from qgis.PyQt.QtWidgets import (
     QAction,
     QMessageBox,
     QDialog,
     QVBoxLayout,
-    QListWidget,
-    QListWidgetItem,
+    QListView,
     QPushButton,
     QHBoxLayout,
     QLabel,
-    QProgressDialog,
-    QApplication,
     QWidget,
     QGroupBox,
     QRadioButton,
     QButtonGroup,
     QSplitter,
     QLineEdit,
+    QTextBrowser,
 )
+from qgis.PyQt.QtNetwork import QNetworkReply, QNetworkRequest
 
-from qgis.core import QgsProject, QgsRasterLayer
-
-# Vector tiles (kan mangle i veldig gamle QGIS)
-try:
-    from qgis.core import QgsVectorTileLayer  # type: ignore
-except Exception:
-    QgsVectorTileLayer = None  # type: ignore
+from qgis.core import QgsNetworkAccessManager, QgsProject, QgsRasterLayer
 
+import functools
+import hashlib
+import json
+import math
 import os
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict, defaultdict
+from itertools import chain
 from typing import Optional, List, Dict, Tuple
 
 
+@functools.lru_cache(maxsize=None)
+def _vt_layer_cls():
+    """
+    QgsVectorTileLayer (kan mangle i veldig gamle QGIS), eller None.
+    Slås opp først når et vector tile-lag faktisk skal lages.
+    """
+    try:
+        from qgis.core import QgsVectorTileLayer  # type: ignore
+    except Exception:
+        return None
+    return QgsVectorTileLayer
+
+
 # -------------------------------------------------------------------------
-# Qt5/Qt6 enum helper + felles konstanter
-# -------------------------------------------------------------------------
-# -------------------------------------------------------------------------
-# Qt5/Qt6 safe enum/attr helper
+# Qt5/Qt6 helpers + felles konstanter
 # -------------------------------------------------------------------------
-def _qt_try(path: str):
-    """Returner Qt-objektet for en 'scoped enum' path, eller None."""
-    obj = Qt
-    for part in path.split("."):
-        if not hasattr(obj, part):
-            return None
-        obj = getattr(obj, part)
-    return obj
+_QT6 = int(qVersion().split(".")[0]) >= 6
+
 
 def palette_role(name: str):
     # Qt5: QPalette.Window
@@ -70,52 +107,847 @@ def dialog_accepted_code():
         return v
     return QDialog.DialogCode.Accepted      # Qt6
 
-def qt_pick(*paths: str, default=None):
+
+# ---- Vanlige enums/flags vi bruker i pluginen ----
+# Qt6 har bare scoped enums (Qt.Orientation.Horizontal), Qt5 de flate navnene.
+# Slås opp én gang her ved import.
+if _QT6:
+    QT_HORIZONTAL = Qt.Orientation.Horizontal
+    QT_VERTICAL = Qt.Orientation.Vertical
+    QT_ALIGN_CENTER = Qt.AlignmentFlag.AlignCenter
+    QT_KEEP_ASPECT = Qt.AspectRatioMode.KeepAspectRatio
+    QT_KEEP_ASPECT_EXPAND = Qt.AspectRatioMode.KeepAspectRatioByExpanding
+    QT_FAST_TRANSFORM = Qt.TransformationMode.FastTransformation
+    QT_SMOOTH_TRANSFORM = Qt.TransformationMode.SmoothTransformation
+    QT_RICHTEXT = Qt.TextFormat.RichText
+    QT_USER_ROLE = Qt.ItemDataRole.UserRole
+    QT_TRANSPARENT = Qt.GlobalColor.transparent
+    QLV_BATCHED = QListView.LayoutMode.Batched
+    QEV_PALETTE_CHANGE = QEvent.Type.PaletteChange
+    QIO_WRITE_ONLY = QBuffer.OpenModeFlag.WriteOnly
+    QT_CACHE_LOCATION = QStandardPaths.StandardLocation.CacheLocation
+    QNR_HTTP_STATUS = QNetworkRequest.Attribute.HttpStatusCodeAttribute
+    QNR_CACHE_LOAD_CONTROL = QNetworkRequest.Attribute.CacheLoadControlAttribute
+    QNR_ALWAYS_NETWORK = QNetworkRequest.CacheLoadControl.AlwaysNetwork
+    QNR_HTTP2_ALLOWED = QNetworkRequest.Attribute.Http2AllowedAttribute
+    QNR_NO_ERROR = QNetworkReply.NetworkError.NoError
+else:
+    QT_HORIZONTAL = Qt.Horizontal
+    QT_VERTICAL = Qt.Vertical
+    QT_ALIGN_CENTER = Qt.AlignCenter
+    QT_KEEP_ASPECT = Qt.KeepAspectRatio
+    QT_KEEP_ASPECT_EXPAND = Qt.KeepAspectRatioByExpanding
+    QT_FAST_TRANSFORM = Qt.FastTransformation
+    QT_SMOOTH_TRANSFORM = Qt.SmoothTransformation
+    QT_RICHTEXT = Qt.RichText
+    QT_USER_ROLE = Qt.UserRole
+    QT_TRANSPARENT = Qt.transparent
+    QLV_BATCHED = QListView.Batched
+    QEV_PALETTE_CHANGE = QEvent.PaletteChange
+    QIO_WRITE_ONLY = QBuffer.WriteOnly
+    QT_CACHE_LOCATION = QStandardPaths.CacheLocation
+    QNR_HTTP_STATUS = QNetworkRequest.HttpStatusCodeAttribute
+    QNR_CACHE_LOAD_CONTROL = QNetworkRequest.CacheLoadControlAttribute
+    QNR_ALWAYS_NETWORK = QNetworkRequest.AlwaysNetwork
+    QNR_HTTP2_ALLOWED = QNetworkRequest.HTTP2AllowedAttribute  # Qt >= 5.8
+    QNR_NO_ERROR = QNetworkReply.NoError
+
+
+def scale_cover(img, tw: int, th: int):
     """
-    Prøv flere Qt-paths i rekkefølge.
-    Eksempel: qt_pick("Orientation.Horizontal", "Horizontal", default=1)
+    Cover-skaler QImage/QPixmap til minst tw x th.
+    Store kilder halveres raskt først, siste steg er smooth.
+
+    Brukes bare når kildestørrelsen ikke var kjent før dekoding (se
+    read_scaled_cover); ellers leverer QImageReader allerede cover-størrelse.
     """
-    for p in paths:
-        v = _qt_try(p)
-        if v is not None:
-            return v
-    return default
+    while img.width() >= 2 * tw and img.height() >= 2 * th:
+        img = img.scaled(img.width() // 2, img.height() // 2, QT_KEEP_ASPECT, QT_FAST_TRANSFORM)
+    return img.scaled(tw, th, QT_KEEP_ASPECT_EXPAND, QT_SMOOTH_TRANSFORM)
 
 
-# ---- Vanlige enums/flags vi bruker i pluginen ----
-QT_HORIZONTAL = qt_pick("Orientation.Horizontal", "Horizontal", default=1)
-QT_VERTICAL   = qt_pick("Orientation.Vertical",   "Vertical",   default=2)
+def read_scaled_cover(path: str, tw: int, th: int) -> QImage:
+    """
+    Les bildet via QImageReader rett i cover-størrelse (minst tw x th),
+    så vi slipper å holde et fullstørrelses bilde i minnet. Trådsikker.
+    """
+    r = QImageReader(path)
+    r.setAutoTransform(True)
+    src = r.size()
+    known = src.isValid() and src.width() > 0 and src.height() > 0
+    if known:
+        f = max(tw / src.width(), th / src.height())
+        if f < 1.0:
+            r.setScaledSize(QSize(
+                max(tw, math.ceil(src.width() * f)),
+                max(th, math.ceil(src.height() * f)),
+            ))
+    img = r.read()
+    if img.isNull():
+        return img
+    if known:
+        # Dekoderen har allerede skalert; bare siste (smooth) steg gjenstår
+        return img.scaled(tw, th, QT_KEEP_ASPECT_EXPAND, QT_SMOOTH_TRANSFORM)
+    return scale_cover(img, tw, th)
+
+
+def read_banner(path: str, tw: int, th: int) -> QImage:
+    """
+    Cover-skaler til tw x th og behold toppen (midtstilt horisontalt). Trådsikker.
+    QImageReader skalerer og beskjærer i samme lesing, så vi slipper et
+    mellombilde i cover-størrelse og en kopi av utsnittet.
+    """
+    r = QImageReader(path)
+    r.setAutoTransform(True)
+    src = r.size()
+    if not src.isValid() or src.width() <= 0 or src.height() <= 0:
+        # Størrelsen er ukjent før dekoding: skaler først, beskjær etterpå
+        img = read_scaled_cover(path, tw, th)
+        if img.isNull() or (img.width() == tw and img.height() == th):
+            return img
+        x = (img.width() - tw) // 2 if img.width() > tw else 0
+        return img.copy(x, 0, tw, th)
+
+    f = max(tw / src.width(), th / src.height())
+    cw = max(tw, math.ceil(src.width() * f))
+    ch = max(th, math.ceil(src.height() * f))
+    r.setScaledSize(QSize(cw, ch))
+    r.setScaledClipRect(QRect((cw - tw) // 2, 0, tw, th))
+    return r.read()
+
+
+# Tegntabeller for url=...-parameteren i QGIS-URI-er (str.translate: ett pass,
+# så '%' trenger ikke lenger å kodes først)
+_URI_ENC = str.maketrans({"%": "%25", "=": "%3D", "&": "%26"})
+_XYZ_ENC = str.maketrans({"%": "%25", "&": "%26", "{": "%7B", "}": "%7D"})
+
+
+@functools.lru_cache(maxsize=256)
+def encode_uri_url(url: str) -> str:
+    # Samme capabilities-URL går igjen i mange varianter: kod den én gang
+    return url.translate(_URI_ENC)
+
+# Variant-typer som grupperes sammen i dialogen (xyz regnes under "wmts")
+_WMTS_TYPES = frozenset({"wmts", "xyz"})
+_VT_TYPES = frozenset({"vectortile", "vt", "mvt", "arcgis_vt", "arcgisvectortile"})
+
+# Variantfelt med få, ofte gjentatte verdier ("wms", "EPSG:3857", "image/png" ...).
+# Capabilities-/tjeneste-URL-ene går igjen i alle CRS-variantene av en tjeneste.
+_INTERN_VARIANT_KEYS = (
+    "label", "crs", "format", "style", "styles", "layer", "layers", "tileMatrixSet",
+    "capabilities", "url",
+)
 
-# AlignCenter = AlignHCenter (0x0004) | AlignVCenter (0x0080) = 0x0084
-QT_ALIGN_CENTER = qt_pick("AlignmentFlag.AlignCenter", "AlignCenter", default=0x0084)
 
-# TextBrowserInteraction finnes som scoped i Qt6
-QT_TEXT_BROWSER = qt_pick(
-    "TextInteractionFlag.TextBrowserInteraction",
-    "TextBrowserInteraction",
-    default=0
-)
+def intern_variant_fields(services: List[Dict]):
+    """
+    Intern gjentatte strengverdier i variantene (in-place), slik at like
+    verdier deler ett str-objekt på tvers av tjenester.
+    "type" normaliseres samtidig til lowercase.
+    """
+    for v in iter_variants(services):
+        t = v.get("type")
+        if isinstance(t, str):
+            v["type"] = sys.intern(t.lower())
+        for k in _INTERN_VARIANT_KEYS:
+            val = v.get(k)
+            if isinstance(val, str):
+                v[k] = sys.intern(val)
+
+
+def iter_service_variants(services: List[Dict]):
+    """(svc, variant) for alle varianter i services (både 'offerings' og eldre 'variants')."""
+    for svc in services:
+        for off in (svc.get("offerings") or {}).values():
+            if isinstance(off, dict):
+                for v in off.get("variants") or []:
+                    if isinstance(v, dict):
+                        yield svc, v
+        for v in svc.get("variants") or []:
+            if isinstance(v, dict):
+                yield svc, v
+
+
+def iter_variants(services: List[Dict]):
+    """Alle variant-dicts i services."""
+    for _svc, v in iter_service_variants(services):
+        yield v
+
 
-# AspectRatio / Transformation
-# AspectRatioMode.KeepAspectRatioByExpanding = 2
-QT_KEEP_ASPECT_EXPAND = qt_pick(
-    "AspectRatioMode.KeepAspectRatioByExpanding",
-    "KeepAspectRatioByExpanding",
-    default=2
+# -------------------------------------------------------------------------
+# Standardvarianter (samme projeksjoner for alle Kartverket-tjenester)
+# -------------------------------------------------------------------------
+_KARTVERKET_WMTS_CAP = "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities"
+
+# (label, tileMatrixSet, crs)
+_STD_WMTS_TMS = (
+    ("UTM 32N (EPSG:25832)", "utm32n", "EPSG:25832"),
+    ("UTM 33N (EPSG:25833)", "utm33n", "EPSG:25833"),
+    ("UTM 35N (EPSG:25835)", "utm35n", "EPSG:25835"),
+    ("WebMercator (EPSG:3857)", "webmercator", "EPSG:3857"),
 )
 
-# TransformationMode.SmoothTransformation = 1
-QT_SMOOTH_TRANSFORM = qt_pick(
-    "TransformationMode.SmoothTransformation",
-    "SmoothTransformation",
-    default=1
+# (label, crs)
+_STD_WMS_CRS = (
+    ("UTM 32N (EPSG:25832)", "EPSG:25832"),
+    ("UTM 33N (EPSG:25833)", "EPSG:25833"),
+    ("UTM 35N (EPSG:25835)", "EPSG:25835"),
+    ("WebMercator (EPSG:3857)", "EPSG:3857"),
+    ("WGS84 (EPSG:4326)", "EPSG:4326"),
 )
 
-# TextFormat.RichText = 1
-QT_RICHTEXT = qt_pick("TextFormat.RichText", "RichText", default=1)
 
-# ItemDataRole.UserRole = 0x0100
-QT_USER_ROLE = qt_pick("ItemDataRole.UserRole", "UserRole", default=0x0100)
+def _std_wmts_variants(layer: str, capabilities: str = _KARTVERKET_WMTS_CAP) -> List[Dict]:
+    return [
+        {
+            "type": "wmts", "label": label, "capabilities": capabilities, "layer": layer,
+            "style": "default", "format": "image/png", "tileMatrixSet": tms, "crs": crs,
+        }
+        for label, tms, crs in _STD_WMTS_TMS
+    ]
+
+
+def _std_wms_variants(url: str, layers: str) -> List[Dict]:
+    return [
+        {
+            "type": "wms", "label": label, "url": url, "layers": layers,
+            "styles": "", "format": "image/png", "crs": crs,
+        }
+        for label, crs in _STD_WMS_CRS
+    ]
+
+
+_STD_VARIANTS = {"wmts": _std_wmts_variants, "wms": _std_wms_variants}
+
+
+def expand_std_variants(services: List[Dict]):
+    """
+    Bygg ut kortformen "std_variants" i en offering (services.json) til
+    standard variantliste for offering-typen, f.eks.
+    "wmts": {"label": "WMTS", "std_variants": {"layer": "topo"}}.
+    Eventuelle egne "variants" legges etter standardvariantene.
+    """
+    for svc in services:
+        for key, off in (svc.get("offerings") or {}).items():
+            if not isinstance(off, dict) or "std_variants" not in off:
+                continue
+            make = _STD_VARIANTS.get(key)
+            if make is None:
+                raise ValueError(f"{svc.get('name')}: 'std_variants' støttes ikke for '{key}'.")
+            off["variants"] = make(**off.pop("std_variants")) + list(off.get("variants") or [])
+
+
+def index_service_paths(services: List[Dict], plugin_dir: str):
+    """
+    Sett svc["_thumb_abs"/"_preview_abs"] og tilhørende "_exists"-flagg.
+    Hver mappe listes én gang med os.scandir i stedet for os.path.exists per fil.
+    """
+    listings: Dict[str, set] = {}
+
+    def resolve(rel: Optional[str]) -> Tuple[Optional[str], bool]:
+        if not rel:
+            return None, False
+        p = os.path.join(plugin_dir, rel)
+        d, fname = os.path.split(p)
+        names = listings.get(d)
+        if names is None:
+            try:
+                with os.scandir(d) as it:
+                    names = {e.name for e in it if e.is_file()}
+            except OSError:
+                names = set()
+            listings[d] = names
+        return p, fname in names
+
+    for svc in services:
+        svc["_thumb_abs"], svc["_thumb_exists"] = resolve(svc.get("thumb") or svc.get("preview"))
+        svc["_preview_abs"], svc["_preview_exists"] = resolve(svc.get("preview"))
+
+
+# -------------------------------------------------------------------------
+# Lag-URI-er (bygges én gang når tjenestene lastes)
+# -------------------------------------------------------------------------
+# URI-maler (url=... legges på til slutt for WMTS/WMS, se "_uri_params")
+_XYZ_TMPL = "type=xyz&url={url}&zmin={zmin}&zmax={zmax}&crs=EPSG3857"
+_WMTS_TMPL = "crs={crs}&format={format}&layers={layer}&styles={style}&tileMatrixSet={tileMatrixSet}"
+_WMS_TMPL = "crs={crs}&format={format}&layers={layers}&styles={styles}"
+_ARCGIS_VT_TMPL = "serviceType=arcgis&styleUrl={style_url}&type=xyz&url={url}&zmin={zmin}&zmax={zmax}"
+
+
+def precompute_layer_uris(services: List[Dict]):
+    """
+    Sett variant["_uri"] (ferdig QGIS-URI mot tjenesten) på alle varianter.
+    WMTS/WMS får i tillegg "_uri_params" (alt utenom url=...), slik at url
+    kan byttes mot en lokal capabilities-kopi uten å bygge resten på nytt,
+    "_cap_key" (cache-nøkkel for capabilities-URL-en) og "_cap_layer"
+    (laget som må finnes i en lokal kopi, se capabilities_has_layer).
+
+    Varianter som mangler påkrevde felt gir ValueError (alle listes), slik
+    at feil i services.json oppdages ved lasting og ikke ved første klikk.
+    """
+    errors: List[str] = []
+
+    def missing(svc: Dict, v: Dict, fields: str):
+        errors.append(
+            f"{svc.get('name') or '(uten navn)'} / {v.get('label') or '(uten label)'}: mangler {fields}"
+        )
+
+    for svc, v in iter_service_variants(services):
+        t = v.get("type") or ""
+
+        if t == "xyz":
+            url_tmpl = v.get("xyz_url")
+            if not url_tmpl:
+                missing(svc, v, "'xyz_url'")
+                continue
+            v["_uri"] = _XYZ_TMPL.format_map({
+                "url": url_tmpl.translate(_XYZ_ENC),
+                "zmin": int(v.get("zmin", 0)),
+                "zmax": int(v.get("zmax", 21)),
+            })
+
+        elif t == "wmts":
+            cap = v.get("capabilities")
+            layer = v.get("layer")
+            tms = v.get("tileMatrixSet")
+            if not cap or not layer or not tms:
+                missing(svc, v, "'capabilities', 'layer' eller 'tileMatrixSet'")
+                continue
+            params = _WMTS_TMPL.format_map({
+                "crs": v.get("crs", "EPSG:25833"),
+                "format": v.get("format", "image/png"),
+                "layer": layer,
+                "style": v.get("style", "default"),
+                "tileMatrixSet": tms,
+            })
+            v["_uri_params"] = params
+            v["_uri"] = f"{params}&url={encode_uri_url(cap)}"
+            v["_cap_key"] = capabilities_key(cap)
+            v["_cap_layer"] = layer
+
+        elif t == "wms":
+            url = v.get("url")
+            layers = v.get("layers") or v.get("layer")
+            if not url or not layers:
+                missing(svc, v, "'url' eller 'layers' (eller 'layer')")
+                continue
+            params = _WMS_TMPL.format_map({
+                "crs": v.get("crs", "EPSG:25833"),
+                "format": v.get("format", "image/png"),
+                "layers": layers,
+                "styles": v.get("styles", ""),
+            })
+            v["_uri_params"] = params
+            v["_uri"] = f"{params}&url={encode_uri_url(url)}"
+            v["_cap_key"] = capabilities_key(url)
+            v["_cap_layer"] = layers.split(",", 1)[0]
+
+        elif t in _VT_TYPES:
+            # Du kan enten oppgi ferdig 'uri' i variant,
+            # eller bruke style_url + url/service_url for å bygge.
+            uri = v.get("uri")
+            if not uri:
+                service_url = v.get("url") or v.get("service_url")
+                style_url = v.get("style_url") or v.get("styleUrl")
+                if not service_url or not style_url:
+                    missing(svc, v, "'uri' eller (service_url/url + style_url/styleUrl)")
+                    continue
+                # ArcGIS VectorTileServer (slik QGIS normalt lagrer det)
+                uri = _ARCGIS_VT_TMPL.format_map({
+                    "style_url": style_url,
+                    "url": service_url,
+                    "zmin": int(v.get("zmin", 0)),
+                    "zmax": int(v.get("zmax", 14)),
+                })
+            v["_uri"] = uri
+
+    if errors:
+        raise ValueError("Ugyldige varianter i tjenestekatalogen:\n\n" + "\n".join(errors))
+
+
+# -------------------------------------------------------------------------
+# GetCapabilities-cache (på disk)
+# -------------------------------------------------------------------------
+CAPABILITIES_TTL_S = 24 * 3600  # som QGIS' egen standard for WMS-capabilities
+PREFETCH_WAIT_S = 60  # maks ventetid på en pågående prefetch ved lag-opprettelse
+
+
+def _cache_dir() -> str:
+    # Felles for capabilities-kopier og bannere (undermappe "banners")
+    return os.path.join(QStandardPaths.writableLocation(QT_CACHE_LOCATION), "bakgrunnskart")
+
+
+def capabilities_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def _capabilities_cache_path(key: str) -> str:
+    return os.path.join(_cache_dir(), f"{key}.xml")
+
+
+def _write_file_atomic(path: str, data: bytes):
+    # Unikt temp-navn per tråd: to skrivere kan ikke blande innholdet
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read_capabilities_meta(xml_path: str) -> Optional[Dict]:
+    """Sidecar-metadata for en lokal kopi; None hvis vi ikke har noen kopi."""
+    if not os.path.isfile(xml_path):
+        return None
+    try:
+        with open(xml_path[:-len(".xml")] + ".meta.json", "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def _capabilities_is_fresh(meta: Optional[Dict]) -> bool:
+    return meta is not None and time.time() - float(meta.get("fetched", 0)) < CAPABILITIES_TTL_S
+
+
+def _capabilities_request(url: str, meta: Optional[Dict]) -> QNetworkRequest:
+    req = QNetworkRequest(QUrl(url))
+    req.setAttribute(QNR_CACHE_LOAD_CONTROL, QNR_ALWAYS_NETWORK)
+    # Flere capabilities mot samme vert: la Qt multiplekse på én HTTP/2-forbindelse
+    req.setAttribute(QNR_HTTP2_ALLOWED, True)
+    if meta:
+        if meta.get("etag"):
+            req.setRawHeader(b"If-None-Match", meta["etag"].encode("latin-1"))
+        if meta.get("last_modified"):
+            req.setRawHeader(b"If-Modified-Since", meta["last_modified"].encode("latin-1"))
+    return req
+
+
+# Én lås per cache-fil: LayerLoader-tråder og prefetch (GUI-tråden) kan
+# lagre samme dokument samtidig, og XML + .meta.json skal skrives som ett par
+_capabilities_locks: Dict[str, threading.Lock] = {}
+_capabilities_locks_guard = threading.Lock()
+
+
+def _capabilities_lock(xml_path: str) -> threading.Lock:
+    with _capabilities_locks_guard:
+        lock = _capabilities_locks.get(xml_path)
+        if lock is None:
+            lock = _capabilities_locks[xml_path] = threading.Lock()
+        return lock
+
+
+def _store_capabilities_reply(url: str, xml_path: str, meta: Optional[Dict], reply, data: bytes) -> Optional[str]:
+    """
+    Lagre svaret på _capabilities_request (QNetworkReply eller
+    QgsNetworkReplyContent). Returnerer stien til gjeldende kopi, eller None.
+    Trådsikker.
+    """
+    with _capabilities_lock(xml_path):
+        return _store_capabilities_reply_locked(url, xml_path, meta, reply, data)
+
+
+def _store_capabilities_reply_locked(
+    url: str, xml_path: str, meta: Optional[Dict], reply, data: bytes
+) -> Optional[str]:
+    ok = reply.error() == QNR_NO_ERROR
+    status = reply.attribute(QNR_HTTP_STATUS)
+    now = time.time()
+
+    if ok and status == 304 and meta is not None:
+        meta["fetched"] = now
+    else:
+        # Ikke cache feilsider / ServiceException
+        if not ok or b"Capabilities" not in data:
+            return xml_path if meta is not None else None
+        os.makedirs(os.path.dirname(xml_path), exist_ok=True)
+        _write_file_atomic(xml_path, data)
+        meta = {
+            "url": url,
+            "fetched": now,
+            "etag": bytes(reply.rawHeader(b"ETag")).decode("latin-1"),
+            "last_modified": bytes(reply.rawHeader(b"Last-Modified")).decode("latin-1"),
+        }
+
+    _write_file_atomic(xml_path[:-len(".xml")] + ".meta.json", json.dumps(meta).encode("utf-8"))
+    return xml_path
+
+
+def cached_capabilities(url: str, key: Optional[str] = None) -> Optional[str]:
+    """
+    Sti til en lokal kopi av GetCapabilities-dokumentet for url, eller None.
+
+    Kopien brukes uten nettverk i CAPABILITIES_TTL_S. Etter det revalideres
+    den med betinget GET (If-None-Match / If-Modified-Since). Ved
+    nettverksfeil brukes en eventuell gammel kopi.
+    key er capabilities_key(url), gjerne forhåndsberegnet (variant["_cap_key"]).
+
+    Er dokumentet allerede på vei via prefetch_capabilities, ventes det på
+    det svaret i stedet for å starte en ny GET. I GUI-tråden (der svaret
+    ikke kan komme fram mens vi venter) returneres None: bruk tjenestens URL.
+    """
+    key = key or capabilities_key(url)
+    xml_path = _capabilities_cache_path(key)
+    meta = _read_capabilities_meta(xml_path)
+    if _capabilities_is_fresh(meta):
+        return xml_path
+
+    pending = _prefetch_in_flight.get(key)
+    if pending is not None:
+        if QThread.currentThread() == QCoreApplication.instance().thread():
+            return None
+        if not pending.wait(PREFETCH_WAIT_S):
+            return None
+        meta = _read_capabilities_meta(xml_path)
+        if _capabilities_is_fresh(meta):
+            return xml_path
+        # Prefetchen feilet; ny forespørsel er et nytt forsøk, ikke et duplikat
+
+    reply = QgsNetworkAccessManager.instance().blockingGet(_capabilities_request(url, meta))
+    return _store_capabilities_reply(url, xml_path, meta, reply, bytes(reply.content()))
+
+
+# capabilities_key -> Event for prefetch-forespørsler som ikke har fått svar
+# ennå. Eventen settes når svaret er lagret (se cached_capabilities).
+_prefetch_in_flight: Dict[str, threading.Event] = {}
+
+
+def prefetch_capabilities(keys: Dict[str, str]) -> int:
+    """
+    Start asynkron henting av capabilities (keys: url -> capabilities_key)
+    som mangler eller er utgått i disk-cachen. Svarene lagres når de kommer.
+    Dokumenter som allerede er på vei hentes ikke på nytt.
+    Returnerer antall startet.
+    """
+    nam = QgsNetworkAccessManager.instance()
+    started = 0
+    for url, key in keys.items():
+        if key in _prefetch_in_flight:
+            continue
+        xml_path = _capabilities_cache_path(key)
+        meta = _read_capabilities_meta(xml_path)
+        if _capabilities_is_fresh(meta):
+            continue
+        reply = nam.get(_capabilities_request(url, meta))
+        reply.finished.connect(functools.partial(_on_prefetch_finished, url, key, xml_path, meta, reply))
+        _prefetch_in_flight[key] = threading.Event()
+        started += 1
+    return started
+
+
+def _on_prefetch_finished(url: str, key: str, xml_path: str, meta: Optional[Dict], reply):
+    try:
+        _store_capabilities_reply(url, xml_path, meta, reply, bytes(reply.readAll()))
+    except Exception:
+        pass  # prefetch er bare en optimalisering; cached_capabilities prøver igjen
+    finally:
+        reply.deleteLater()
+        # Først nå: ventende lag-opprettelser skal se den lagrede kopien
+        pending = _prefetch_in_flight.pop(key, None)
+        if pending is not None:
+            pending.set()
+
+
+# url=...-verdi som peker på en lokal capabilities-kopi (se cached_capabilities).
+# Bare "<sha1>.xml"-slutten matches, og verdien går til neste '&' (stien kan
+# inneholde mellomrom, f.eks. "C:/Users/Ola Nordmann/...").
+_LOCAL_CAP_RE = re.compile(r"url=[^&]*?bakgrunnskart[/\\]([0-9a-f]{40})\.xml(?=&|$)")
+
+
+def _remote_capabilities_url(m) -> str:
+    meta = _read_capabilities_meta(_capabilities_cache_path(m.group(1)))
+    remote = (meta or {}).get("url")
+    return f"url={encode_uri_url(remote)}" if remote else m.group(0)
+
+
+def _to_remote_source(src: str) -> str:
+    if "bakgrunnskart" not in src:
+        return src
+    return _LOCAL_CAP_RE.sub(_remote_capabilities_url, src)
+
+
+def restore_remote_capabilities(doc):
+    """
+    Koblet til QgsProject.writeProject: lagres prosjektet, skal lagene peke
+    på tjenesten – ikke på vår lokale cache-fil (prosjektet må fungere på
+    andre maskiner). Fjern-URL-en leses fra kopiens .meta.json, så dette
+    virker også for lag lagt til før en plugin-reload.
+
+    Kilden står flere steder (<datasource>, <layer-tree-layer source=...>,
+    ...), så alle attributter og tekstnoder i dokumentet gås gjennom.
+    """
+    stack = [doc.documentElement()]
+    while stack:
+        node = stack.pop()
+        if node.isElement():
+            attrs = node.attributes()
+            for i in range(attrs.count()):
+                attr = attrs.item(i).toAttr()
+                value = attr.value()
+                new_value = _to_remote_source(value)
+                if new_value != value:
+                    attr.setValue(new_value)
+        elif node.isCharacterData():
+            text = node.toCharacterData()
+            data = text.data()
+            new_data = _to_remote_source(data)
+            if new_data != data:
+                text.setData(new_data)
+
+        child = node.firstChild()
+        while not child.isNull():
+            stack.append(child)
+            child = child.nextSibling()
+
+
+def project_uses_local_capabilities() -> bool:
+    """Om et lag i prosjektet peker på en lokal capabilities-kopi."""
+    return any(
+        _LOCAL_CAP_RE.search(lyr.source())
+        for lyr in QgsProject.instance().mapLayers().values()
+    )
+
+
+# Dynamisk property på QgsProject.instance() med hooken som er koblet til
+# writeProject. Lever på tvers av plugin-reloads: én hook per økt.
+_WRITE_HOOK_PROPERTY = "bakgrunnskart_write_hook"
+
+
+def install_write_hook():
+    project = QgsProject.instance()
+    old = project.property(_WRITE_HOOK_PROPERTY)
+    if old is restore_remote_capabilities:
+        return
+    if old is not None:
+        try:
+            project.writeProject.disconnect(old)  # fra en tidligere lastet modul
+        except Exception:
+            pass
+    project.writeProject.connect(restore_remote_capabilities)
+    project.setProperty(_WRITE_HOOK_PROPERTY, restore_remote_capabilities)
+
+
+def uninstall_write_hook():
+    project = QgsProject.instance()
+    old = project.property(_WRITE_HOOK_PROPERTY)
+    if old is None:
+        return
+    try:
+        project.writeProject.disconnect(old)
+    except Exception:
+        pass
+    project.setProperty(_WRITE_HOOK_PROPERTY, None)
+
+
+def _local_tag(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def capabilities_has_layer(cap_xml_path: str, layer_name: str) -> bool:
+    """
+    Om GetCapabilities-dokumentet (WMTS eller WMS) har et lag med
+    Identifier/Name layer_name.
+
+    Dokumentet strømmes med iterparse, og hvert ferdig element fjernes fra
+    forelderen straks det er lest. Minnebruken er dermed uavhengig av
+    dokumentets størrelse, også når laget mangler og hele filen må leses.
+    """
+    open_els = []  # åpne elementer, roten først
+    layers: List[int] = []  # indeks i open_els for åpne Layer-elementer
+    named: List[bool] = []  # om tilsvarende Layer allerede har fått navn
+
+    for event, el in ET.iterparse(cap_xml_path, events=("start", "end")):
+        if event == "start":
+            if _local_tag(el.tag) == "Layer":
+                layers.append(len(open_els))
+                named.append(False)
+            open_els.append(el)
+            continue
+
+        open_els.pop()
+        tag = _local_tag(el.tag)
+        if layers:
+            if len(open_els) == layers[-1] + 1 and tag in ("Identifier", "Name") and not named[-1]:
+                # direkte barn av gjeldende Layer (ikke Style o.l.); første
+                # vinner: WMS-lag kan ha <Identifier authority=...> etter <Name>
+                named[-1] = True
+                if (el.text or "").strip() == layer_name:
+                    return True
+            elif tag == "Layer" and len(open_els) == layers[-1]:
+                layers.pop()
+                named.pop()
+
+        # Et ferdig element er alltid siste barn av forelderen
+        if open_els:
+            del open_els[-1][-1]
+
+    return False
+
+
+# -------------------------------------------------------------------------
+# Banner-cache (på disk, overlever QGIS-omstart)
+# -------------------------------------------------------------------------
+BANNER_DISK_CACHE_SIZE = 32  # ferdige bannere (ca. 0.1–0.5 MB hver)
+
+
+def _banner_cache_path(path: str, tw: int, th: int) -> Optional[str]:
+    """Cache-fil for banneret til path i tw x th px; ny nøkkel når kilden endres."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    key = hashlib.sha1(f"{path}\0{mtime}\0{tw}x{th}".encode("utf-8")).hexdigest()
+    return os.path.join(_cache_dir(), "banners", f"{key}.png")
+
+
+def _store_banner(cache_path: str, img: QImage):
+    # Kodes i minnet: feiler save, blir det ingen halvskrevet fil liggende
+    buf = QBuffer()
+    buf.open(QIO_WRITE_ONLY)
+    if not img.save(buf, "PNG"):
+        return
+    d = os.path.dirname(cache_path)
+    os.makedirs(d, exist_ok=True)
+    _write_file_atomic(cache_path, bytes(buf.data()))
+
+    # LRU på mtime (treff "touches" i read_cached_banner)
+    entries = [e for e in os.scandir(d) if e.name.endswith(".png")]
+    if len(entries) > BANNER_DISK_CACHE_SIZE:
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries[:len(entries) - BANNER_DISK_CACHE_SIZE]:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
+
+
+def read_cached_banner(path: str, tw: int, th: int) -> QImage:
+    """
+    Som read_banner, men ferdig skalerte bannere gjenbrukes fra disk-cachen,
+    også på tvers av QGIS-økter. Trådsikker.
+    """
+    cache_path = _banner_cache_path(path, tw, th)
+    if cache_path and os.path.isfile(cache_path):
+        img = QImage(cache_path)
+        if not img.isNull() and img.width() == tw and img.height() == th:
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+            return img
+
+    img = read_banner(path, tw, th)
+    if cache_path and not img.isNull():
+        try:
+            _store_banner(cache_path, img)
+        except OSError:
+            pass  # cachen er bare en optimalisering
+    return img
+
+
+# -------------------------------------------------------------------------
+# Bakgrunnslasting av thumbs
+# -------------------------------------------------------------------------
+class _ThumbSignals(QObject):
+    # row, path, dpr, ferdig skalert bilde (QImage – QPixmap er ikke trådsikker)
+    loaded = pyqtSignal(int, str, float, QImage)
+
+
+class ThumbLoader(QRunnable):
+    """
+    Leser og skalerer én thumb i en QThreadPool-tråd.
+    Resultatet sendes som QImage; konvertering til QPixmap skjer i GUI-tråden.
+    """
+
+    def __init__(self, path: str, size: int, dpr: float, row: int, signals: _ThumbSignals):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.dpr = dpr
+        self.row = row
+        self.signals = signals
+
+    def run(self):
+        s = max(1, int(self.size * self.dpr))
+        img = read_scaled_cover(self.path, s, s)
+        if img.isNull():
+            return
+        self.signals.loaded.emit(self.row, self.path, self.dpr, img)
+
+
+class _BannerSignals(QObject):
+    # path, dpr, ferdig skalert og beskåret banner
+    loaded = pyqtSignal(str, float, QImage)
+
+
+class BannerLoader(QRunnable):
+    """Leser, skalerer og beskjærer stor preview i en QThreadPool-tråd."""
+
+    def __init__(self, path: str, w: int, h: int, dpr: float, signals: _BannerSignals):
+        super().__init__()
+        self.path = path
+        self.w = w
+        self.h = h
+        self.dpr = dpr
+        self.signals = signals
+
+    def run(self):
+        img = read_cached_banner(self.path, max(1, int(self.w * self.dpr)), max(1, int(self.h * self.dpr)))
+        # Sendes også ved feil (null-bilde), så ventende-flagget ryddes
+        self.signals.loaded.emit(self.path, self.dpr, img)
+
+
+# -------------------------------------------------------------------------
+# Lag opprettes i bakgrunnen
+# -------------------------------------------------------------------------
+class _LayerSignals(QObject):
+    finished = pyqtSignal(object)  # gyldig lag, allerede flyttet til GUI-tråden
+    failed = pyqtSignal(str)
+
+
+class LayerLoader(QRunnable):
+    """
+    Oppretter og validerer et lag i pluginens egen QThreadPool (WMS/WMTS-
+    provideren kan hente capabilities over nett). Laget flyttes til GUI-tråden før det
+    sendes, så det kan legges i prosjektet der.
+    """
+
+    def __init__(self, create, signals: _LayerSignals):
+        super().__init__()
+        self.create = create
+        self.signals = signals
+
+    def run(self):
+        try:
+            layer = self.create()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        layer.moveToThread(QCoreApplication.instance().thread())
+        self.signals.finished.emit(layer)
+
+
+# -------------------------------------------------------------------------
+# Filter-proxy
+# -------------------------------------------------------------------------
+class _ServiceFilterProxy(QSortFilterProxyModel):
+    """
+    Proxy som viser radene dialogen har regnet ut som synlige.
+    visible=None betyr ingen filter (alle rader vises).
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._visible: Optional[List[bool]] = None
+
+    def set_visible_rows(self, visible: Optional[List[bool]]):
+        if visible == self._visible:
+            return  # samme treff: ingen ny filtrering/relayout
+        self._visible = visible
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        vis = self._visible
+        return vis is None or (source_row < len(vis) and vis[source_row])
+
 
 # -------------------------------------------------------------------------
 # Dialog
@@ -128,13 +960,52 @@ class ServicePickerDialog(QDialog):
       - Radioknapper for tjenestetype (WMTS/WMS/Vector tiles)
       - Radioknapper for variants (tileset / CRS)
     Returnerer (service_dict, type_key, variant_dict) eller (None, None, None)
+
+    Forventer at tjenestene er indeksert (svc["_offerings"], svc["_blob"],
+    svc["_thumb_abs"] osv.), se BakgrunnskartPlugin._build_search_index().
     """
 
     PREVIEW_W = 550
     PREVIEW_H = 220
 
+    FILTER_DELAY_MS = 120  # debounce for søkefeltet
+    PIXMAP_CACHE_KB = 20_000  # QPixmapCache er global – vi hever bare grensen
+    THUMB_ROW_BUFFER = 2  # rader over/under synlig område som også lastes
+    THUMB_LRU_SIZE = 128  # maks antall rader med ekte thumb-ikon samtidig
+
     TYPE_ORDER = ["wmts", "wms", "vectortile"]  # stabil rekkefølge
 
+    # Delt mellom dialogåpninger, nøkkel: icon_size
+    _placeholder_icons: Dict[int, QIcon] = {}
+
+    # Sist viste bannere, nøkkel: (path, dpr). Holdes utenom QPixmapCache
+    # (som kan kaste dem ut), så det går straks å bla tilbake til dem.
+    BANNER_LRU_SIZE = 5
+    _banner_lru: "OrderedDict[Tuple[str, float], QPixmap]" = OrderedDict()
+
+    # (is_dark, tekstfarge, lenkefarge)
+    _THEME_COLORS = (
+        (True, "#ffffff", "#4ea3ff"),
+        (False, "#222222", "#0b57d0"),
+    )
+
+    # Ferdig stylesheet for hele dialogen per tema, nøkkel: is_dark.
+    # Ett setStyleSheet på dialogen i stedet for ett per label.
+    _DIALOG_QSS = {
+        is_dark: (
+            "QLabel#previewBig { border: 1px solid rgba(255,255,255,0.15); }"
+            f"QLabel#titleLabel {{ color: {text_color}; font-size: 13px; }}"
+            f"QTextBrowser#descText {{ color: {text_color}; background: transparent; border: none; }}"
+        )
+        for is_dark, text_color, _link_color in _THEME_COLORS
+    }
+
+    # Lenkefarge må settes i dokumentet selv (Qt-stylesheet når ikke <a>)
+    _DESC_DOC_CSS = {
+        is_dark: f"a {{ color: {link_color}; text-decoration: underline; }}"
+        for is_dark, _text_color, link_color in _THEME_COLORS
+    }
+
     def __init__(self, parent, services: List[Dict], plugin_dir: str, icon_size: int = 50):
         super().__init__(parent)
         self.setWindowTitle("Bakgrunnskart")
@@ -145,6 +1016,31 @@ class ServicePickerDialog(QDialog):
         self.plugin_dir = plugin_dir
         self.icon_size = icon_size
 
+        # Konstant så lenge dialogen står på samme skjerm; oppdateres i showEvent
+        self._dpr = self.devicePixelRatioF() or 1.0
+
+        # Thumbs dekodes i bakgrunnen og settes inn når de er klare
+        self._pool = QThreadPool.globalInstance()
+        self._thumb_signals = _ThumbSignals(self)
+        self._thumb_signals.loaded.connect(self._on_thumb_loaded)
+        self._thumb_paths: List[Optional[str]] = []
+        self._thumb_pending: set = set()
+        self._thumb_lru: "OrderedDict[int, bool]" = OrderedDict()
+
+        # Stor preview lastes også i bakgrunnen; valgbytte returnerer straks
+        self._banner_signals = _BannerSignals(self)
+        self._banner_signals.loaded.connect(self._on_banner_loaded)
+        self._banner_pending: set = set()
+
+        # Thumbs lastes bare for rader i/nær viewporten (samles i ett pass)
+        self._thumb_timer = QTimer(self)
+        self._thumb_timer.setSingleShot(True)
+        self._thumb_timer.setInterval(0)
+        self._thumb_timer.timeout.connect(self._load_visible_thumbs)
+
+        if QPixmapCache.cacheLimit() < self.PIXMAP_CACHE_KB:
+            QPixmapCache.setCacheLimit(self.PIXMAP_CACHE_KB)
+
         self._selected_service: Optional[Dict] = None
         self._selected_type_key: Optional[str] = None
         self._selected_variant: Optional[Dict] = None
@@ -168,43 +1064,67 @@ class ServicePickerDialog(QDialog):
         self.search.setPlaceholderText("Søk…")
         left_layout.addWidget(self.search)
 
-        self.lw = QListWidget()
+        # Modell: én rad per tjeneste. Proxyen viser radene _do_apply_filter
+        # har regnet ut som treff (parallelt med self._blobs).
+        self.model = QStandardItemModel(self)
+        self.proxy = _ServiceFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self._blobs: List[str] = []
+        self._trigrams: Dict[str, set] = {}  # trigram -> radindekser
+        self._char_buckets: Dict[str, set] = {}  # tegn -> radindekser (korte søkeord)
+        self._charmasks = array("Q")  # 64-bits tegnmaske per blob (Bloom-aktig forsil)
+        self._applied_query: Optional[str] = None
+        self._last_pattern: Tuple[str, object] = ("", None)  # (query, kompilert matcher)
+
+        self.lw = QListView()
+        self.lw.setModel(self.proxy)
         self.lw.setIconSize(QSize(self.icon_size, self.icon_size))
+        # Alle rader er like høye (ikon/plassholder + én linje): ingen måling per rad
+        self.lw.setUniformItemSizes(True)
+        self.lw.setLayoutMode(QLV_BATCHED)
+        self.lw.setBatchSize(50)
+        self.lw.verticalScrollBar().valueChanged.connect(self._schedule_visible_thumbs)
+        self.lw.verticalScrollBar().rangeChanged.connect(self._schedule_visible_thumbs)
         left_layout.addWidget(self.lw, 1)
         splitter.addWidget(left)
 
         # ---------------- RIGHT ----------------
-        right = QWidget()
+        right = self.right_panel = QWidget()
         right_layout = QVBoxLayout(right)
         right_layout.setContentsMargins(0, 0, 0, 0)
         splitter.addWidget(right)
 
         # Stor preview
         self.preview_big = QLabel()
+        self.preview_big.setObjectName("previewBig")
         self.preview_big.setAlignment(QT_ALIGN_CENTER)
         self.preview_big.setMinimumHeight(self.PREVIEW_H)
-        self.preview_big.setStyleSheet("QLabel { border: 1px solid rgba(255,255,255,0.15); }")
         right_layout.addWidget(self.preview_big)
 
         # Tittel
         self.title_label = QLabel("")
+        self.title_label.setObjectName("titleLabel")
         self.title_label.setWordWrap(True)
         self.title_label.setTextFormat(QT_RICHTEXT)
         right_layout.addWidget(self.title_label)
 
-        # Beskrivelse
-        self.desc = QLabel("")
-        self.desc.setWordWrap(True)
-        self.desc.setTextFormat(QT_RICHTEXT)
-        self.desc.setTextInteractionFlags(QT_TEXT_BROWSER)
+        # Beskrivelse: hver tjeneste har sitt ferdig parsede QTextDocument
+        # (svc["_desc_doc"]); valgbytte bytter bare dokument
+        self.desc = QTextBrowser()
+        self.desc.setObjectName("descText")
         self.desc.setOpenExternalLinks(True)
+        self._desc_blank = QTextDocument(self)
+        self._desc_shown = self._desc_blank  # holder vist dokument i live
+        self.desc.setDocument(self._desc_blank)
         right_layout.addWidget(self.desc)
 
+        self._last_is_dark: Optional[bool] = None
         self._apply_desc_colors()
 
         # --- Tjenestetype ---
         self.types_box = QGroupBox("Velg tjenestetype")
         self.types_layout = QHBoxLayout(self.types_box)
+        self.types_layout.addStretch(1)
         right_layout.addWidget(self.types_box)
 
         self.type_group = QButtonGroup(self)
@@ -214,12 +1134,22 @@ class ServicePickerDialog(QDialog):
         # --- Variantvalg ---
         self.variants_box = QGroupBox("Velg tileset / projeksjon")
         self.variants_layout = QVBoxLayout(self.variants_box)
+        self.variants_layout.addStretch(1)
         right_layout.addWidget(self.variants_box)
 
         self.variant_group = QButtonGroup(self)
         self.variant_group.setExclusive(True)
         self.variant_group.buttonClicked.connect(self._on_variant_clicked)
 
+        # Radioknappene gjenbrukes mellom valg (skjules når de ikke trengs)
+        self._type_rb_pool: List[QRadioButton] = []
+        self._variant_rb_pool: List[QRadioButton] = []
+
+        # Knapp -> payload (id(btn)); unngår QVariant-runden via setProperty,
+        # og variant-dicten blir ikke kopiert til en QVariantMap
+        self._type_key_by_btn: Dict[int, str] = {}
+        self._variant_by_btn: Dict[int, Dict] = {}
+
         # Buttons
         btn_row = QHBoxLayout()
         self.btn_ok = QPushButton("Legg til")
@@ -234,42 +1164,90 @@ class ServicePickerDialog(QDialog):
 
         # Fill list
         self._populate_services()
-        self.lw.currentItemChanged.connect(self._on_service_changed)
 
-        # Søk/filter
+        # Valgbytter samles: holdes piltasten nede, oppdateres høyre panel
+        # bare for raden som er valgt når event-loopen får tid
+        self._service_timer = QTimer(self)
+        self._service_timer.setSingleShot(True)
+        self._service_timer.setInterval(0)
+        self._service_timer.timeout.connect(self._realize_service_change)
+        self.lw.selectionModel().currentChanged.connect(self._service_timer.start)
+
+        # Søk/filter (debounced: rask skriving gir ett filtreringspass)
+        self._pending_query = ""
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.FILTER_DELAY_MS)
+        self._filter_timer.timeout.connect(self._do_apply_filter)
         self.search.textChanged.connect(self._apply_filter)
 
-        if self.lw.count() > 0:
-            self.lw.setCurrentRow(0)
-            self._on_service_changed(self.lw.currentItem(), None)
+        if self.proxy.rowCount() > 0:
+            self.lw.setCurrentIndex(self.proxy.index(0, 0))
+            self._on_service_changed(self.lw.currentIndex(), None)
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        # Dialogen kan åpnes på en annen skjerm enn den ble laget på
+        dpr = self.devicePixelRatioF() or 1.0
+        if dpr == self._dpr:
+            return
+        self._dpr = dpr
+        self._thumb_lru.clear()
+        self._schedule_visible_thumbs()
+        if self._selected_service is not None:
+            self._update_preview(self._selected_service)
+
+    def changeEvent(self, e):
+        super().changeEvent(e)
+        # Lyst/mørkt tema byttet mens QGIS kjører
+        if e.type() == QEV_PALETTE_CHANGE:
+            self._apply_desc_colors()
 
     # -------------------------
     # Theme-aware colors
     # -------------------------
     def _apply_desc_colors(self):
-        pal = self.palette()
-        bg = pal.color(palette_role("Window"))
-        is_dark = bg.lightness() < 128
+        is_dark = self.palette().color(palette_role("Window")).lightness() < 128
 
-        text_color = "#ffffff" if is_dark else "#222222"
-        link_color = "#4ea3ff" if is_dark else "#0b57d0"
-
-        self.title_label.setStyleSheet(f"QLabel {{ color: {text_color}; font-size: 13px; }}")
-        self.desc.setStyleSheet(
-            f"QLabel {{ color: {text_color}; }}"
-            f"QLabel a {{ color: {link_color}; text-decoration: underline; }}"
-        )
+        # setStyleSheet re-poliserer alle barna – bare når temaet faktisk byttes
+        # (stopper også PaletteChange som stylesheetet selv utløser)
+        if is_dark == self._last_is_dark:
+            return
+        self._last_is_dark = is_dark
+        self.setStyleSheet(self._DIALOG_QSS[is_dark])
+        if self._selected_service is not None:
+            self._show_description(self._selected_service)
+
+    def _show_description(self, svc: Optional[Dict]):
+        if svc is None:
+            doc = self._desc_blank
+        else:
+            # HTML-en parses én gang per tjeneste og tema, og overlever dialogen
+            doc = svc.get("_desc_doc")
+            if doc is None or svc.get("_desc_doc_dark") != self._last_is_dark:
+                doc = QTextDocument()
+                doc.setDefaultStyleSheet(self._DESC_DOC_CSS[self._last_is_dark])
+                doc.setHtml(svc.get("description", ""))
+                svc["_desc_doc"] = doc
+                svc["_desc_doc_dark"] = self._last_is_dark
+        if doc is self._desc_shown:
+            return
+        # Byttet dokument slippes først etter at browseren har gitt slipp på det
+        self.desc.setDocument(doc)
+        self._desc_shown = doc
 
     # -------------------------
     # Offerings (bakoverkompat)
     # -------------------------
-    def _normalize_offerings(self, svc: Dict) -> Dict:
+    @staticmethod
+    def _normalize_offerings(svc: Dict) -> Dict:
         """
         Returnerer alltid et dict:
           { "wmts": {"label":"...", "variants":[...]}, "wms": {...}, "vectortile": {...} }
 
         Hvis svc har 'offerings', brukes den.
         Hvis svc bare har 'variants', grupperes de etter type (wmts/wms/xyz/...)
+        Forutsetter at variant-typene er normalisert (intern_variant_fields).
         """
         offerings = svc.get("offerings")
         if isinstance(offerings, dict) and offerings:
@@ -286,12 +1264,12 @@ class ServicePickerDialog(QDialog):
         for v in variants:
             if not isinstance(v, dict):
                 continue
-            t = (v.get("type") or "").lower()
-            if t in ("wmts", "xyz"):
+            t = v.get("type") or ""
+            if t in _WMTS_TYPES:
                 wmts_like.append(v)
             elif t == "wms":
                 wms_like.append(v)
-            elif t in ("vectortile", "vt", "mvt", "arcgis_vt", "arcgisvectortile"):
+            elif t in _VT_TYPES:
                 vt_like.append(v)
             else:
                 # ukjent -> legg i wmts-blokka (så det i det minste dukker opp)
@@ -311,242 +1289,466 @@ class ServicePickerDialog(QDialog):
         return out
 
     # -------------------------
-    # HiDPI + crop helper
+    # Stor preview (banner)
     # -------------------------
-    def _scaled_crop_top_pixmap(self, pm: QPixmap, target_w: int, target_h: int) -> QPixmap:
-        if pm.isNull():
+    @staticmethod
+    def _pixmap_cache_key(path: str, w: int, h: int, dpr: float) -> str:
+        return f"bakgrunnskart:{path}:{dpr}:{w}x{h}"
+
+    @staticmethod
+    def _find_cached_pixmap(key: str) -> Optional[QPixmap]:
+        pm = QPixmapCache.find(key)  # Qt5: null-pixmap ved bom, Qt6: None
+        if pm is not None and not pm.isNull():
             return pm
-
-        dpr = self.devicePixelRatioF() or 1.0
-        tw = max(1, int(target_w * dpr))
-        th = max(1, int(target_h * dpr))
-
-        scaled = pm.scaled(tw, th, QT_KEEP_ASPECT_EXPAND, QT_SMOOTH_TRANSFORM)
-
-        x = int((scaled.width() - tw) / 2) if scaled.width() > tw else 0
-        y = 0
-        cropped = scaled.copy(x, y, tw, th)
-        cropped.setDevicePixelRatio(dpr)
-        return cropped
+        return None
 
     # -------------------------
     # Populate + search filter
     # -------------------------
     def _populate_services(self):
-        self.lw.clear()
+        self._blobs = []
+        self._thumb_paths = []
+        self._thumb_pending.clear()
+        self._thumb_lru.clear()
 
-        for svc in self.services:
+        items: List[QStandardItem] = []
+        for row, svc in enumerate(self.services):
             name = svc.get("name", "(uten navn)")
-            item = QListWidgetItem(name)
-
-            offerings = self._normalize_offerings(svc)
-
-            # søkeblob: navn + desc + typelabels + variantlabels
-            type_labels = []
-            variant_labels = []
-            for tkey, off in offerings.items():
-                if isinstance(off, dict):
-                    type_labels.append((off.get("label") or tkey))
-                    for v in (off.get("variants") or []):
-                        if isinstance(v, dict):
-                            variant_labels.append(v.get("label") or "")
-
-            search_blob = " ".join(
-                [
-                    (svc.get("name") or ""),
-                    (svc.get("description") or ""),
-                    " ".join(type_labels),
-                    " ".join(variant_labels),
-                ]
-            ).lower()
+            item = QStandardItem(name)
+            item.setEditable(False)
+
+            # NB: radindeks, ikke dict – PyQt konverterer dict til QVariantMap (kopi)
+            item.setData(row, QT_USER_ROLE)
+            self._blobs.append(svc["_blob"])
 
-            item.setData(QT_USER_ROLE, svc)
-            item.setData(QT_USER_ROLE + 1, search_blob)
+            # thumb ikon (liste) – plassholder nå, ekte ikon når raden blir synlig
+            thumb_path = svc["_thumb_abs"] if svc["_thumb_exists"] else None
+            if thumb_path:
+                item.setIcon(self._get_placeholder_icon())
+            self._thumb_paths.append(thumb_path)
 
-            # thumb ikon (liste)
-            thumb_rel = svc.get("thumb") or svc.get("preview")  # fallback
-            if thumb_rel:
-                p = os.path.join(self.plugin_dir, thumb_rel)
-                if os.path.exists(p):
-                    pm = QPixmap(p)
-                    if not pm.isNull():
-                        dpr = self.devicePixelRatioF() or 1.0
-                        s = max(1, int(self.icon_size * dpr))
-                        icon_pm = pm.scaled(s, s, QT_KEEP_ASPECT_EXPAND, QT_SMOOTH_TRANSFORM)
-                        icon_pm.setDevicePixelRatio(dpr)
-                        item.setIcon(QIcon(icon_pm))
+            items.append(item)
 
-            self.lw.addItem(item)
+        # Alle rader inn i ett kall: én rowsInserted og én relayout i viewen
+        self.lw.setUpdatesEnabled(False)
+        was_blocked = self.lw.blockSignals(True)
+        try:
+            self.model.clear()
+            self.model.invisibleRootItem().appendRows(items)
+        finally:
+            self.lw.blockSignals(was_blocked)
+            self.lw.setUpdatesEnabled(True)
+
+        self._trigrams = self._build_trigrams(self._blobs)
+        self._char_buckets = self._build_char_buckets(self._blobs)
+        self._charmasks = array("Q", map(self._charmask, self._blobs))
+        self._applied_query = None
+
+        # Ikonene lastes etterpå (neste runde i event-loopen)
+        self._schedule_visible_thumbs()
+
+    def _schedule_visible_thumbs(self, *_args):
+        self._thumb_timer.start()
+
+    def _load_visible_thumbs(self):
+        n = self.proxy.rowCount()
+        if n == 0:
+            return
+
+        vp = self.lw.viewport().rect()
+        top = self.lw.indexAt(vp.topLeft())
+        bottom = self.lw.indexAt(vp.bottomLeft())
+        first = top.row() if top.isValid() else 0
+        last = bottom.row() if bottom.isValid() else n - 1
+
+        buf = self.THUMB_ROW_BUFFER
+        for prow in range(max(0, first - buf), min(n, last + buf + 1)):
+            src = self.proxy.mapToSource(self.proxy.index(prow, 0))
+            self._request_thumb(src.row())
+
+    def _request_thumb(self, row: int):
+        if row < 0 or row >= len(self._thumb_paths):
+            return
+        path = self._thumb_paths[row]
+        if path is None or row in self._thumb_pending:
+            return
+        if row in self._thumb_lru:
+            self._thumb_lru.move_to_end(row)
+            return
+
+        dpr = self._dpr
+        pm = self._find_cached_pixmap(self._pixmap_cache_key(path, self.icon_size, self.icon_size, dpr))
+        if pm is not None:
+            self._set_thumb(row, QIcon(pm))
+            return
+
+        self._thumb_pending.add(row)
+        self._pool.start(ThumbLoader(path, self.icon_size, dpr, row, self._thumb_signals))
+
+    def _set_thumb(self, row: int, icon: QIcon):
+        it = self.model.item(row)
+        if it is None:
+            return
+        it.setIcon(icon)
+
+        # LRU: rader som har vært lengst ute av syne får plassholderen tilbake
+        self._thumb_lru[row] = True
+        self._thumb_lru.move_to_end(row)
+        while len(self._thumb_lru) > self.THUMB_LRU_SIZE:
+            old_row, _ = self._thumb_lru.popitem(last=False)
+            old = self.model.item(old_row)
+            if old is not None:
+                old.setIcon(self._get_placeholder_icon())
+
+    def _get_placeholder_icon(self) -> QIcon:
+        # Gjennomsiktig ikon i full størrelse, så radene ikke hopper når thumbs kommer
+        icon = self._placeholder_icons.get(self.icon_size)
+        if icon is None:
+            pm = QPixmap(self.icon_size, self.icon_size)
+            pm.fill(QT_TRANSPARENT)
+            icon = self._placeholder_icons[self.icon_size] = QIcon(pm)
+        return icon
+
+    def _on_thumb_loaded(self, row: int, path: str, dpr: float, img: QImage):
+        # Kjører i GUI-tråden (queued fra ThumbLoader)
+        self._thumb_pending.discard(row)
+        if dpr != self._dpr:
+            # Skjermen er byttet siden lasteren startet. showEvent hoppet over
+            # raden mens den ventet; be om den på nytt med riktig DPR
+            self._request_thumb(row)
+            return
+        if row < len(self._thumb_paths) and self._thumb_paths[row] == path:
+            pm = QPixmap.fromImage(img)
+            pm.setDevicePixelRatio(dpr)
+            # Begrenset cache: rader LRU-en har kastet ut kan hentes tilbake
+            # uten ny dekoding så lenge QPixmapCache har plass til dem
+            QPixmapCache.insert(self._pixmap_cache_key(path, self.icon_size, self.icon_size, dpr), pm)
+            self._set_thumb(row, QIcon(pm))
+
+    def _service_at(self, index: QModelIndex) -> Optional[Dict]:
+        if index is None or not index.isValid():
+            return None
+        row = index.data(QT_USER_ROLE)
+        if isinstance(row, int) and 0 <= row < len(self.services):
+            return self.services[row]
+        return None
 
     def _apply_filter(self, text: str):
-        q = (text or "").strip().lower()
-
-        any_visible = False
-        for i in range(self.lw.count()):
-            it = self.lw.item(i)
-            blob = (it.data(QT_USER_ROLE + 1) or "")
-            show = (q in blob) if q else True
-            it.setHidden(not show)
-            if show:
-                any_visible = True
-
-        cur = self.lw.currentItem()
-        if cur is None or cur.isHidden():
-            if any_visible:
-                for i in range(self.lw.count()):
-                    it = self.lw.item(i)
-                    if not it.isHidden():
-                        self.lw.setCurrentItem(it)
-                        break
-            else:
-                self.preview_big.clear()
-                self.title_label.setText("")
-                self.desc.setText("")
-                self._clear_types()
-                self._clear_variants()
+        self._pending_query = text or ""
+        self._filter_timer.start()
+
+    @staticmethod
+    def _build_trigrams(blobs: List[str]) -> Dict[str, set]:
+        index = defaultdict(set)
+        for row, blob in enumerate(blobs):
+            for tri in {blob[i:i + 3] for i in range(len(blob) - 2)}:
+                index[tri].add(row)
+        return dict(index)
+
+    @staticmethod
+    def _build_char_buckets(blobs: List[str]) -> Dict[str, set]:
+        buckets = defaultdict(set)
+        for row, blob in enumerate(blobs):
+            for c in set(blob):
+                buckets[c].add(row)
+        return dict(buckets)
+
+    @staticmethod
+    def _charmask(text: str) -> int:
+        # Bit (ord(c) % 64) for hvert tegn: mangler bloben et tegn fra søket,
+        # kan raden avvises med én heltalls-AND
+        m = 0
+        for c in set(text):
+            m |= 1 << (ord(c) & 63)
+        return m
+
+    def _candidate_rows(self, q: str) -> set:
+        # Rader som inneholder alle trigrammene i q. Kortere ord (1–2 tegn)
+        # slås opp i bøtta for første tegn; matcheren sjekker resten.
+        if len(q) < 3:
+            return set(self._char_buckets.get(q[:1], ()))
+        cands: Optional[set] = None
+        for i in range(len(q) - 2):
+            rows = self._trigrams.get(q[i:i + 3])
+            if not rows:
+                return set()
+            cands = set(rows) if cands is None else cands & rows
+            if not cands:
+                break
+        return cands or set()
+
+    def _query_matcher(self, q: str):
+        """
+        Kompilert matcher for q: alle ordene må finnes i bloben, i vilkårlig
+        rekkefølge ("europa utm33" treffer "... utm 33 ... europa"). Flere ord
+        blir ett regex med lookaheads, så hver rad sjekkes i ett C-pass.
+        """
+        if self._last_pattern[0] == q:
+            return self._last_pattern[1]
+        terms = q.split()
+        if len(terms) == 1:
+            match = re.compile(re.escape(terms[0])).search
+        else:
+            match = re.compile("".join(f"(?=.*?{re.escape(t)})" for t in terms), re.DOTALL).match
+        self._last_pattern = (q, match)
+        return match
+
+    def _do_apply_filter(self):
+        q = " ".join(self._pending_query.lower().split())
+        if q == self._applied_query:
+            return  # f.eks. bare mellomrom lagt til
+        self._applied_query = q
+
+        # blobs er allerede lowercase. Hvert ord gir kandidater (trigram-
+        # indeks, eller tegnbøtte for korte ord); snittet sjekkes med
+        # tegnmaske og til slutt den kompilerte matcheren.
+        visible: Optional[List[bool]] = None
+        if q:
+            cands: Optional[set] = None
+            for term in q.split():
+                rows = self._candidate_rows(term)
+                cands = rows if cands is None else cands & rows
+                if not cands:
+                    break
+
+            match = self._query_matcher(q)
+            blobs = self._blobs
+            masks = self._charmasks
+            qm = self._charmask(q.replace(" ", ""))
+            visible = [False] * len(blobs)
+            for row in cands or ():
+                visible[row] = (masks[row] & qm) == qm and match(blobs[row]) is not None
+
+        # Selection-signalene blokkeres så vi bare oppdaterer høyre panel
+        # én gang etterpå.
+        sm = self.lw.selectionModel()
+        self.lw.setUpdatesEnabled(False)
+        was_blocked = sm.blockSignals(True)
+        try:
+            self.proxy.set_visible_rows(visible)
+            if not self.lw.currentIndex().isValid() and self.proxy.rowCount() > 0:
+                self.lw.setCurrentIndex(self.proxy.index(0, 0))
+        finally:
+            sm.blockSignals(was_blocked)
+            self.lw.setUpdatesEnabled(True)
+            self.lw.viewport().update()
+
+        # Nye rader kan ha kommet inn i viewporten
+        self._schedule_visible_thumbs()
+
+        cur = self.lw.currentIndex()
+        if cur.isValid():
+            if self._service_at(cur) is not self._selected_service:
+                self._on_service_changed(cur, None)
+        else:
+            self._selected_service = None
+            self.preview_big.clear()
+            self.title_label.setText("")
+            self._show_description(None)
+            self._clear_types()
+            self._clear_variants()
 
     # -------------------------
     # Types + Variants
     # -------------------------
-    def _clear_types(self):
-        for b in list(self.type_group.buttons()):
-            self.type_group.removeButton(b)
-            b.setParent(None)
-            b.deleteLater()
-
-        while self.types_layout.count():
-            it = self.types_layout.takeAt(0)
-            w = it.widget()
-            if w:
-                w.setParent(None)
-                w.deleteLater()
+    @staticmethod
+    def _ensure_rb_pool(pool: List[QRadioButton], group: QButtonGroup, layout, n: int):
+        # Nye knapper legges foran stretch-elementet på slutten av layouten
+        while len(pool) < n:
+            rb = QRadioButton()
+            group.addButton(rb)
+            layout.insertWidget(len(pool), rb)
+            pool.append(rb)
+
+    @staticmethod
+    def _uncheck_all(group: QButtonGroup):
+        # En eksklusiv gruppe lar seg ikke avhuke direkte
+        group.setExclusive(False)
+        for b in group.buttons():
+            b.setChecked(False)
+        group.setExclusive(True)
 
+    def _clear_types(self):
+        self._uncheck_all(self.type_group)
+        for rb in self._type_rb_pool:
+            rb.setVisible(False)
+        self._type_key_by_btn.clear()
         self._selected_type_key = None
 
     def _clear_variants(self):
-        for b in list(self.variant_group.buttons()):
-            self.variant_group.removeButton(b)
-            b.setParent(None)
-            b.deleteLater()
-
-        while self.variants_layout.count():
-            it = self.variants_layout.takeAt(0)
-            w = it.widget()
-            if w:
-                w.setParent(None)
-                w.deleteLater()
-
+        self._uncheck_all(self.variant_group)
+        for rb in self._variant_rb_pool:
+            rb.setVisible(False)
+        self._variant_by_btn.clear()
         self._selected_variant = None
 
     def _populate_types(self, svc: Dict):
-        self._clear_types()
-        offerings = self._normalize_offerings(svc)
+        offerings = svc["_offerings"]
 
         keys = [k for k in self.TYPE_ORDER if k in offerings] + sorted(
             [k for k in offerings.keys() if k not in self.TYPE_ORDER]
         )
 
-        first_enabled = None
-        for k in keys:
-            off = offerings.get(k) or {}
-            label = (off.get("label") if isinstance(off, dict) else None) or k.upper()
-
-            rb = QRadioButton(label)
-            rb.setProperty("type_key", k)
-
-            disabled = bool(off.get("disabled")) if isinstance(off, dict) else False
-            if disabled:
-                rb.setEnabled(False)
-                rb.setToolTip((off.get("disabled_reason") if isinstance(off, dict) else None) or "Ikke tilgjengelig")
-            else:
-                if first_enabled is None:
-                    first_enabled = k
-
-            self.type_group.addButton(rb)
-            self.types_layout.addWidget(rb)
-
-        self.types_layout.addStretch(1)
-
-        # Velg første enabled
-        if first_enabled:
-            for b in self.type_group.buttons():
-                if b.property("type_key") == first_enabled:
-                    b.setChecked(True)
-                    self._selected_type_key = first_enabled
-                    break
+        pool = self._type_rb_pool
+        self.types_box.setUpdatesEnabled(False)
+        try:
+            self._ensure_rb_pool(pool, self.type_group, self.types_layout, len(keys))
+            self._uncheck_all(self.type_group)
+            self._type_key_by_btn.clear()
+            self._selected_type_key = None
+
+            first_enabled = None
+            first_rb = None
+            for rb, k in zip(pool, keys):
+                off = offerings.get(k) or {}
+                label = (off.get("label") if isinstance(off, dict) else None) or k.upper()
+
+                rb.setText(label)
+                self._type_key_by_btn[id(rb)] = k
+
+                disabled = bool(off.get("disabled")) if isinstance(off, dict) else False
+                rb.setEnabled(not disabled)
+                if disabled:
+                    rb.setToolTip((off.get("disabled_reason") if isinstance(off, dict) else None) or "Ikke tilgjengelig")
+                else:
+                    rb.setToolTip("")
+                    if first_enabled is None:
+                        first_enabled = k
+                        first_rb = rb
+                rb.setVisible(True)
+
+            for rb in pool[len(keys):]:
+                rb.setVisible(False)
+
+            # Velg første enabled
+            if first_rb is not None:
+                first_rb.setChecked(True)
+                self._selected_type_key = first_enabled
+        finally:
+            self.types_box.setUpdatesEnabled(True)
 
     def _populate_variants_for_type(self, svc: Dict, type_key: Optional[str]):
-        self._clear_variants()
-        offerings = self._normalize_offerings(svc)
+        offerings = svc["_offerings"]
         off = (offerings.get(type_key) if type_key else None) or {}
 
         variants = off.get("variants") if isinstance(off, dict) else None
         if not variants:
             variants = [{"label": "Standard", "key": "default"}]
+        entries = [(i, v) for i, v in enumerate(variants) if isinstance(v, dict)]
 
-        first = True
-        for i, v in enumerate(variants):
-            if not isinstance(v, dict):
-                continue
-            label = v.get("label", f"Variant {i+1}")
+        pool = self._variant_rb_pool
+        self.variants_box.setUpdatesEnabled(False)
+        try:
+            self._ensure_rb_pool(pool, self.variant_group, self.variants_layout, len(entries))
+            self._uncheck_all(self.variant_group)
+            self._variant_by_btn.clear()
+            self._selected_variant = None
+
+            for rb, (i, v) in zip(pool, entries):
+                rb.setText(v.get("label", f"Variant {i+1}"))
+                self._variant_by_btn[id(rb)] = v
+                rb.setVisible(True)
+
+            for rb in pool[len(entries):]:
+                rb.setVisible(False)
+
+            if entries:
+                pool[0].setChecked(True)
+                self._selected_variant = entries[0][1]
+        finally:
+            self.variants_box.setUpdatesEnabled(True)
 
-            rb = QRadioButton(label)
-            rb.setProperty("variant_dict", v)
-            self.variant_group.addButton(rb)
-            self.variants_layout.addWidget(rb)
+    def _find_banner(self, path: str, dpr: float) -> Optional[QPixmap]:
+        key = (path, dpr)
+        pm = self._banner_lru.get(key)
+        if pm is not None:
+            self._banner_lru.move_to_end(key)
+            return pm
+        return self._find_cached_pixmap(self._pixmap_cache_key(path, self.PREVIEW_W, self.PREVIEW_H, dpr))
 
-            if first:
-                rb.setChecked(True)
-                self._selected_variant = v
-                first = False
+    def _update_preview(self, svc: Dict):
+        """Vis banneret straks hvis det er cachet, ellers last det i bakgrunnen."""
+        if not svc["_preview_exists"]:
+            self.preview_big.clear()
+            return
 
-        self.variants_layout.addStretch(1)
+        path, dpr = svc["_preview_abs"], self._dpr
+        pm = self._find_banner(path, dpr)
+        if pm is not None:
+            self.preview_big.setPixmap(pm)
+            return
 
-    def _on_service_changed(self, current: QListWidgetItem, _prev: QListWidgetItem):
-        if current is None or current.isHidden():
+        self.preview_big.clear()
+        if (path, dpr) not in self._banner_pending:
+            self._banner_pending.add((path, dpr))
+            self._pool.start(BannerLoader(path, self.PREVIEW_W, self.PREVIEW_H, dpr, self._banner_signals))
+
+    def _on_banner_loaded(self, path: str, dpr: float, img: QImage):
+        # Kjører i GUI-tråden (queued fra BannerLoader)
+        self._banner_pending.discard((path, dpr))
+        if img.isNull():
+            return
+        pm = QPixmap.fromImage(img)
+        pm.setDevicePixelRatio(dpr)
+        QPixmapCache.insert(self._pixmap_cache_key(path, self.PREVIEW_W, self.PREVIEW_H, dpr), pm)
+        self._banner_lru[(path, dpr)] = pm
+        self._banner_lru.move_to_end((path, dpr))
+        while len(self._banner_lru) > self.BANNER_LRU_SIZE:
+            self._banner_lru.popitem(last=False)
+
+        # Brukeren kan ha gått videre mens banneret ble lastet
+        svc = self._selected_service
+        if svc is not None and svc["_preview_abs"] == path and dpr == self._dpr:
+            self.preview_big.setPixmap(pm)
+
+    def _realize_service_change(self):
+        cur = self.lw.currentIndex()
+        if cur.isValid() and self._service_at(cur) is not self._selected_service:
+            self._on_service_changed(cur, None)
+
+    def _on_service_changed(self, current: QModelIndex, _prev: Optional[QModelIndex]):
+        svc = self._service_at(current)
+        if svc is None:
             return
 
-        svc = current.data(QT_USER_ROLE)
         self._selected_service = svc
 
-        # Preview (stor)
-        preview_rel = svc.get("preview")
-        if preview_rel:
-            p = os.path.join(self.plugin_dir, preview_rel)
-            if os.path.exists(p):
-                pm = QPixmap(p)
-                if not pm.isNull():
-                    banner = self._scaled_crop_top_pixmap(pm, self.PREVIEW_W, self.PREVIEW_H)
-                    self.preview_big.setPixmap(banner)
-                else:
-                    self.preview_big.clear()
-            else:
-                self.preview_big.clear()
-        else:
-            self.preview_big.clear()
+        # Hele høyre panel oppdateres samlet: én relayout/repaint til slutt
+        self.right_panel.setUpdatesEnabled(False)
+        try:
+            self._update_preview(svc)
 
-        # Title + description
-        name = svc.get("name", "")
-        self.title_label.setText(f"<b>{name}</b>")
-        self.desc.setText(svc.get("description", ""))
+            # Title + description
+            name = svc.get("name", "")
+            self.title_label.setText(f"<b>{name}</b>")
+            self._show_description(svc)
 
-        # Types + variants
-        self._populate_types(svc)
-        self._populate_variants_for_type(svc, self._selected_type_key)
+            # Types + variants
+            self._populate_types(svc)
+            self._populate_variants_for_type(svc, self._selected_type_key)
+        finally:
+            self.right_panel.setUpdatesEnabled(True)
 
     def _on_type_clicked(self, btn: QRadioButton):
-        k = btn.property("type_key")
-        if isinstance(k, str):
+        k = self._type_key_by_btn.get(id(btn))
+        if k is not None:
             self._selected_type_key = k
             if self._selected_service:
                 self._populate_variants_for_type(self._selected_service, k)
 
     def _on_variant_clicked(self, btn: QRadioButton):
-        v = btn.property("variant_dict")
-        if isinstance(v, dict):
+        v = self._variant_by_btn.get(id(btn))
+        if v is not None:
             self._selected_variant = v
 
     def _accept(self):
+        # Enter rett etter skriving: filteret må ha kjørt før valget leses
+        if self._filter_timer.isActive():
+            self._filter_timer.stop()
+            self._do_apply_filter()
+        if self._service_timer.isActive():
+            self._service_timer.stop()
+            self._realize_service_change()
         if not self._selected_service:
             QMessageBox.information(self, "Bakgrunnskart", "Velg en tjeneste først.")
             return
@@ -558,6 +1760,27 @@ class ServicePickerDialog(QDialog):
             return
         self.accept()
 
+    def reset_selection(self):
+        """
+        Klargjør dialogen for en ny åpning: tomt søk og første tjeneste valgt.
+        Modell, ikoner og søkeindeks beholdes.
+        """
+        self._filter_timer.stop()
+        self._service_timer.stop()
+        was_blocked = self.search.blockSignals(True)
+        self.search.clear()
+        self.search.blockSignals(was_blocked)
+        self._pending_query = ""
+        self._do_apply_filter()
+
+        self._selected_service = None
+        self._selected_type_key = None
+        self._selected_variant = None
+        if self.proxy.rowCount() > 0:
+            self.lw.setCurrentIndex(self.proxy.index(0, 0))
+            self.lw.scrollToTop()
+            self._on_service_changed(self.lw.currentIndex(), None)
+
     def get_selection(self) -> Tuple[Optional[Dict], Optional[str], Optional[Dict]]:
         if self.result() != dialog_accepted_code():
             return None, None, None
@@ -574,775 +1797,119 @@ class BakgrunnskartPlugin:
     - Alle lag samles i én gruppe: "Bakgrunnskart"
     """
 
+    # __weakref__: PyQt holder bare svake referanser til bundne metoder i connect()
+    __slots__ = (
+        "iface", "action", "toolbar", "_dispatch",
+        "_menu_title", "_action_title", "_dlg", "_layer_pool", "__weakref__",
+    )
+
     MAIN_GROUP_NAME = "Bakgrunnskart"
     PREVIEW_ICON_SIZE = 50  # px
+    LAYER_THREADS = 2  # samtidige lag-opprettelser (venter på nett)
 
     # ---------------------------------------------------------------------
-    # SERVICES (samme innhold som du startet på – kan utvides videre)
+    # SERVICES ligger i services.json (kan utvides videre) og lastes først
+    # når pluginen faktisk brukes, se _load_services().
     # NB: I RichText i QLabel anbefales <br> for linjeskift.
     # ---------------------------------------------------------------------
-    SERVICES = [
-        {
-        "name": "Fjellskygge",
-        "description": "Denne tjenesten inneholder fjellskygger. Den er ment for å kombineres med andre tjenester. <a href=\"https://kartkatalog.geonorge.no/metadata/fjellskygge-wms/57bcf66a-1333-498f-a1f1-13f27a9cee1f\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/shadow.png",
-        "thumb": "previews/shadow_thumb.png",
-        "offerings": {
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.fjellskygge?service=wms&request=getcapabilities",
-                "layers": "fjellskygge_wms",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.fjellskygge?service=wms&request=getcapabilities",
-                "layers": "fjellskygge_wms",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.fjellskygge?service=wms&request=getcapabilities",
-                "layers": "fjellskygge_wms",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.fjellskygge?service=wms&request=getcapabilities",
-                "layers": "fjellskygge_wms",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.fjellskygge?service=wms&request=getcapabilities",
-                "layers": "fjellskygge_wms",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Flybilder (OBS! Fjernes 1. mars 2026)",
-        "description": "Ortofoto (Norge i bilder). <a href=\"https://kartkatalog.geonorge.no/metadata/norge-i-bilder-wmts-mercator/1b690a65-4fed-4e5e-ad77-1218e2bf315f\">Se mer informasjon</a>. OBS! Tjenesten stenges fra 1. mars 2026. <a href=\"https://register.geonorge.no/varsler/norge-i-bilder-wmts-mercator/f0dd601a-54d9-40f1-bfeb-3a8f672ccd6c\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/aerial.png",
-        "thumb": "previews/aerial_thumb.png",
-        "offerings": {
-            "wmts": {
-            "label": "WMTS /XYZ",
-            "variants": [
-                {
-                    "type": "xyz",
-                    "label": "WebMercator (EPSG:3857)",
-                    "xyz_url": (
-                        "https://opencache.statkart.no/gatekeeper/gk/gk.open_nib_web_mercator_wmts_v2"
-                        "?SERVICE=WMTS&REQUEST=GetTile&VERSION=1.0.0"
-                        "&LAYER=Nibcache_web_mercator_v2"
-                        "&STYLE=default"
-                        "&FORMAT=image/jpgpng"
-                        "&tileMatrixSet=default028mm"
-                        "&tileMatrix={z}"
-                        "&tileRow={y}"
-                        "&tileCol={x}"
+    SERVICES: Optional[List[Dict]] = None
+    SERVICES_FILE = "services.json"
+
+    @classmethod
+    def _load_services(cls):
+        if cls.SERVICES is not None:
+            return
+        path = os.path.join(os.path.dirname(__file__), cls.SERVICES_FILE)
+        with open(path, "rb") as f:
+            services = json.loads(f.read())
+        expand_std_variants(services)
+        intern_variant_fields(services)
+        precompute_layer_uris(services)
+        cls.SERVICES = services
+
+    _search_index_built = False
+
+    @classmethod
+    def _build_search_index(cls):
+        """
+        Normaliser offerings og bygg søkeblob (navn + desc + typelabels +
+        variantlabels) én gang for SERVICES. Lagres på hver svc som
+        "_offerings" / "_blob" og gjenbrukes ved hver dialogåpning,
+        sammen med oppslåtte bildestier (index_service_paths).
+        """
+        if cls._search_index_built:
+            return
+
+        index_service_paths(cls.SERVICES, os.path.dirname(__file__))
+
+        for svc in cls.SERVICES:
+            offerings = ServicePickerDialog._normalize_offerings(svc)
+            svc["_offerings"] = offerings
+
+            offs = [(k, off) for k, off in offerings.items() if isinstance(off, dict)]
+            svc["_blob"] = " ".join(
+                chain(
+                    (svc.get("name") or "", svc.get("description") or ""),
+                    ((off.get("label") or k) for k, off in offs),
+                    (
+                        (v.get("label") or "")
+                        for _k, off in offs
+                        for v in (off.get("variants") or [])
+                        if isinstance(v, dict)
                     ),
-                    "zmin": 0,
-                    "zmax": 21,
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Forenklet europakart",
-        "description": "Forenklet bakgrunnskart for Nord-Europa. Egner seg godt som bakgrunnskart under ett av de andre bakgrunnskartene om du skal lage kart som strekker seg utover Norges landegrenser. <a href=\"https://kartkatalog.geonorge.no/metadata/europakart-forenklet-wms/4e904a49-e2dc-4099-b271-9463bdab7846\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/europe.png",
-        "thumb": "previews/europe_thumb.png",
-        "offerings": {
-            "wmts": {
-            "label": "WMTS",
-            "variants": [
-                {
-                    "type": "wmts",
-                    "label": "UTM 32N (EPSG:25832)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "europaForenklet",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm32n",
-                    "crs": "EPSG:25832",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 33N (EPSG:25833)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "europaForenklet",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm33n",
-                    "crs": "EPSG:25833",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 35N (EPSG:25835)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "europaForenklet",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm35n",
-                    "crs": "EPSG:25835",
-                },
-                {
-                    "type": "wmts",
-                    "label": "WebMercator (EPSG:3857)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "europaForenklet",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "webmercator",
-                    "crs": "EPSG:3857",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Norges grunnkart",
-        "description": "Tjenesten inneholder topografiske kart i målestokken 1:500 til 1:10M. <a href=\"https://kartkatalog.geonorge.no/metadata/norges-grunnkart-wms/8ecaa2d5-8b0a-46cf-a2a7-2584f78b12e2\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/basemap.png",
-        "thumb": "previews/basemap_thumb.png",
-        "offerings": {
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Norges grunnkart gråtone",
-        "description": "Tjenesten inneholder topografiske kart i målestokken 1:500 til 1:10M i gråskala. <a href=\"https://kartkatalog.geonorge.no/metadata/norges-grunnkart-graatone-wms/d24a0bf9-1398-4bc4-a4ba-63896b0a599c\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/basemapgrey.png",
-        "thumb": "previews/basemapgrey_thumb.png",
-        "offerings": {
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart_graatone?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart_graatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart_graatone?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart_graatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart_graatone?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart_graatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart_graatone?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart_graatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.norges_grunnkart_graatone?service=wms&request=getcapabilities",
-                "layers": "Norges_grunnkart_graatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Sjøkart",
-        "description": "Sjøkart i rasterformat med sjødata fra overseilingskart, hovedkart, kystkart, havnekart samt Svalbardkart. <a href=\"https://kartkatalog.geonorge.no/metadata/topografisk-norgeskart-wmts--cache/8f381180-1a47-4453-bee7-9a3d64843efa\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/ocean.png",
-        "thumb": "previews/ocean_thumb.png",
-        "offerings": {
-            "wmts": {
-            "label": "WMTS",
-            "variants": [
-                {
-                    "type": "wmts",
-                    "label": "UTM 32N (EPSG:25832)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "sjokartraster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm32n",
-                    "crs": "EPSG:25832",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 33N (EPSG:25833)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "sjokartraster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm33n",
-                    "crs": "EPSG:25833",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 35N (EPSG:25835)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "sjokartraster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm35n",
-                    "crs": "EPSG:25835",
-                },
-                {
-                    "type": "wmts",
-                    "label": "WebMercator (EPSG:3857)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "sjokartraster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "webmercator",
-                    "crs": "EPSG:3857",
-                }
-            ]
-            },
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.sjokartraster2?service=wms&request=getcapabilities",
-                "layers": "all",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.sjokartraster2?service=wms&request=getcapabilities",
-                "layers": "all",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.sjokartraster2?service=wms&request=getcapabilities",
-                "layers": "all",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.sjokartraster2?service=wms&request=getcapabilities",
-                "layers": "all",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.sjokartraster2?service=wms&request=getcapabilities",
-                "layers": "all",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Topografisk gråtonekart",
-        "description": "En gråtone-basert kartografi med kartdata fra N50 til N2000, FKB, matrikkel, høyde- og dybdedata. <a href=\"https://kartkatalog.geonorge.no/metadata/topografisk-norgeskart-wmts--cache/8f381180-1a47-4453-bee7-9a3d64843efa\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/topogrey.png",
-        "thumb": "previews/topogrey_thumb.png",
-        "offerings": {
-            "wmts": {
-            "label": "WMTS",
-            "variants": [
-                {
-                    "type": "wmts",
-                    "label": "UTM 32N (EPSG:25832)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "topograatone",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm32n",
-                    "crs": "EPSG:25832",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 33N (EPSG:25833)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "topograatone",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm33n",
-                    "crs": "EPSG:25833",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 35N (EPSG:25835)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "topograatone",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm35n",
-                    "crs": "EPSG:25835",
-                },
-                {
-                    "type": "wmts",
-                    "label": "WebMercator (EPSG:3857)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "topograatone",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "webmercator",
-                    "crs": "EPSG:3857",
-                }
-            ]
-            },
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topograatone?service=wms&request=getcapabilities",
-                "layers": "topograatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topograatone?service=wms&request=getcapabilities",
-                "layers": "topograatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topograatone?service=wms&request=getcapabilities",
-                "layers": "topograatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topograatone?service=wms&request=getcapabilities",
-                "layers": "topograatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topograatone?service=wms&request=getcapabilities",
-                "layers": "topograatone",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            },
-            "vectortile": {
-            "label": "Vector tiles (kommer)",
-            "disabled": True,
-            "disabled_reason": "Kommer senere",
-            "variants": []
-            }
-        }
-        },
-        {
-        "name": "Topografisk norgeskart",
-        "description": "En kartografi i farger med kartdata fra N50 til N2000, FKB, matrikkel, høyde- og dybdedata. <a href=\"https://kartkatalog.geonorge.no/metadata/topografisk-norgeskart-wmts--cache/8f381180-1a47-4453-bee7-9a3d64843efa\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/topo.png",
-        "thumb": "previews/topo_thumb.png",
-        "offerings": {
-            "wmts": {
-            "label": "WMTS",
-            "variants": [
-                {
-                "type": "wmts",
-                "label": "UTM 32N (EPSG:25832)",
-                "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                "layer": "topo",
-                "style": "default",
-                "format": "image/png",
-                "tileMatrixSet": "utm32n",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wmts",
-                "label": "UTM 33N (EPSG:25833)",
-                "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                "layer": "topo",
-                "style": "default",
-                "format": "image/png",
-                "tileMatrixSet": "utm33n",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wmts",
-                "label": "UTM 35N (EPSG:25835)",
-                "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                "layer": "topo",
-                "style": "default",
-                "format": "image/png",
-                "tileMatrixSet": "utm35n",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wmts",
-                "label": "WebMercator (EPSG:3857)",
-                "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                "layer": "topo",
-                "style": "default",
-                "format": "image/png",
-                "tileMatrixSet": "webmercator",
-                "crs": "EPSG:3857",
-                }
-            ]
-            },
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topo?service=wms&request=getcapabilities",
-                "layers": "topo",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topo?service=wms&request=getcapabilities",
-                "layers": "topo",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topo?service=wms&request=getcapabilities",
-                "layers": "topo",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topo?service=wms&request=getcapabilities",
-                "layers": "topo",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.topo?service=wms&request=getcapabilities",
-                "layers": "topo",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            },
-            "vectortile": {
-            "label": "Vector tiles (under utvikling)",
-            "disabled": True,
-            "disabled_reason": "Kommer senere",
-            "variants": []
-            }
-        }
-        },
-        {
-            "name": "Topografisk rasterkart",
-            "description": "Rasterkart eller \"papirkart\" med lik presentasjon (symbolikk) som kartserien Norge 1:50 000. Innhold fra N50 til N2000 og N5. <a href=\"https://kartkatalog.geonorge.no/metadata/topografisk-norgeskart-wmts--cache/8f381180-1a47-4453-bee7-9a3d64843efa\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-            "preview": "previews/toporaster.png",
-            "thumb": "previews/toporaster_thumb.png",
-            "offerings": {
-            "wmts": {
-            "label": "WMTS",
-            "variants": [
-                {
-                    "type": "wmts",
-                    "label": "UTM 32N (EPSG:25832)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "toporaster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm32n",
-                    "crs": "EPSG:25832",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 33N (EPSG:25833)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "toporaster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm33n",
-                    "crs": "EPSG:25833",
-                },
-                {
-                    "type": "wmts",
-                    "label": "UTM 35N (EPSG:25835)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "toporaster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "utm35n",
-                    "crs": "EPSG:25835",
-                },
-                {
-                    "type": "wmts",
-                    "label": "WebMercator (EPSG:3857)",
-                    "capabilities": "https://cache.kartverket.no/v1/service?service=WMTS&request=GetCapabilities",
-                    "layer": "toporaster",
-                    "style": "default",
-                    "format": "image/png",
-                    "tileMatrixSet": "webmercator",
-                    "crs": "EPSG:3857",
-                }
-            ]
-            },
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.toporaster4?service=wms&request=getcapabilities",
-                "layers": "topografiskraster",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.toporaster4?service=wms&request=getcapabilities",
-                "layers": "topografiskraster",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.toporaster4?service=wms&request=getcapabilities",
-                "layers": "topografiskraster",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.toporaster4?service=wms&request=getcapabilities",
-                "layers": "topografiskraster",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.toporaster4?service=wms&request=getcapabilities",
-                "layers": "topografiskraster",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        },
-        {
-        "name": "Økonomisk kartverk",
-        "description": "Informasjon tilsvarende digitalt økonomisk kartverk (ØK). N5 er basert på utvalgte, generaliserte FKB-data. <a href=\"https://kartkatalog.geonorge.no/metadata/n5raster2-wms/79ea9761-1ac9-4780-a065-e4738835643e\">Se mer informasjon</a><br><br>&copy; <a href=\"https://www.kartverket.no\">Kartverket</a>.",
-        "preview": "previews/economic.png",
-        "thumb": "previews/economic_thumb.png",
-        "offerings": {
-            "wms": {
-            "label": "WMS",
-            "variants": [
-                {
-                "type": "wms",
-                "label": "UTM 32N (EPSG:25832)",
-                "url": "https://wms.geonorge.no/skwms1/wms.n5raster2?service=wms&request=getcapabilities",
-                "layers": "n5Raster_WMS",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25832",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 33N (EPSG:25833)",
-                "url": "https://wms.geonorge.no/skwms1/wms.n5raster2?service=wms&request=getcapabilities",
-                "layers": "n5Raster_WMS",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25833",
-                },
-                {
-                "type": "wms",
-                "label": "UTM 35N (EPSG:25835)",
-                "url": "https://wms.geonorge.no/skwms1/wms.n5raster2?service=wms&request=getcapabilities",
-                "layers": "n5Raster_WMS",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:25835",
-                },
-                {
-                "type": "wms",
-                "label": "WebMercator (EPSG:3857)",
-                "url": "https://wms.geonorge.no/skwms1/wms.n5raster2?service=wms&request=getcapabilities",
-                "layers": "n5Raster_WMS",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:3857",
-                },
-                {
-                "type": "wms",
-                "label": "WGS84 (EPSG:4326)",
-                "url": "https://wms.geonorge.no/skwms1/wms.n5raster2?service=wms&request=getcapabilities",
-                "layers": "n5Raster_WMS",
-                "styles": "",
-                "format": "image/png",
-                "crs": "EPSG:4326",
-                }
-            ]
-            }
-        }
-        }
-    ]
+                )
+            ).lower()
+
+        cls._search_index_built = True
 
     def __init__(self, iface):
         self.iface = iface
         self.action = None
         self.toolbar = None
+        self._dlg: Optional[ServicePickerDialog] = None  # lages ved første run()
+
+        # Egen pool: lag-opprettelse kan blokkere lenge på nett og skal ikke
+        # holde tråder i QThreadPool.globalInstance(), som QGIS bruker til rendering
+        self._layer_pool = QThreadPool()
+        self._layer_pool.setMaxThreadCount(self.LAYER_THREADS)
+
+        # Oversatt én gang; samme streng må brukes i initGui og unload
+        self._menu_title = self.tr("&Kartverket")
+        self._action_title = self.tr("Bakgrunnskart")
+
+        # variant-type -> create_*_layer
+        self._dispatch = {
+            "wmts": self.create_wmts_layer,
+            "xyz": self.create_xyz_layer,
+            "wms": self.create_wms_layer,
+        }
+        self._dispatch.update(dict.fromkeys(_VT_TYPES, self.create_vectortile_layer))
 
     def tr(self, text):
         return QCoreApplication.translate("BakgrunnskartPlugin", text)
 
     def initGui(self):
         icon_path = os.path.join(os.path.dirname(__file__), "icon_bakgrunnskart.svg")
-        self.action = QAction(QIcon(icon_path), self.tr("Bakgrunnskart"), self.iface.mainWindow())
+        self.action = QAction(QIcon(icon_path), self._action_title, self.iface.mainWindow())
         self.action.triggered.connect(self.run)
 
-        self.iface.addPluginToMenu(self.tr("&Kartverket"), self.action)
+        self.iface.addPluginToMenu(self._menu_title, self.action)
         self.toolbar = self.iface.addToolBar("Kartverket")
         self.toolbar.addAction(self.action)
 
+        install_write_hook()
+
     def unload(self):
+        # Hooken blir koblet så lenge lag lagt til før unload fortsatt peker
+        # på cache-filene: de skal lagres med fjern-URL
+        try:
+            if not project_uses_local_capabilities():
+                uninstall_write_hook()
+        except Exception:
+            pass
+
         if self.action:
-            self.iface.removePluginMenu(self.tr("&Kartverket"), self.action)
+            self.iface.removePluginMenu(self._menu_title, self.action)
             try:
                 if self.toolbar:
                     self.toolbar.removeAction(self.action)
@@ -1350,6 +1917,14 @@ class BakgrunnskartPlugin:
                 pass
             self.action = None
 
+        # Dialogen har hovedvinduet som parent og ville ellers overleve pluginen
+        if self._dlg is not None:
+            self._dlg.deleteLater()
+            self._dlg = None
+
+        # Lag som ikke har startet ennå, opprettes ikke
+        self._layer_pool.clear()
+
     # -------------------------
     # Group helper
     # -------------------------
@@ -1364,63 +1939,76 @@ class BakgrunnskartPlugin:
     # URL encode for QGIS URI (url=... parameter)
     # -------------------------
     def encode_url_for_qgis_uri(self, url: str) -> str:
-        # Match QGIS "Kilde": encode '=' og '&' (og '%' først)
-        return (
-            url.replace("%", "%25")
-            .replace("=", "%3D")
-            .replace("&", "%26")
-        )
+        # Match QGIS "Kilde": encode '%', '=' og '&' (ett pass)
+        return encode_uri_url(url)
 
     # -------------------------
-    # Add XYZ layer
+    # Lokal GetCapabilities-kopi
     # -------------------------
-    def add_xyz_layer(self, variant: Dict) -> QgsRasterLayer:
-        url_tmpl = variant["xyz_url"]
-
-        url_enc = (
-            url_tmpl
-            .replace("%", "%25")
-            .replace("&", "%26")
-            .replace("{", "%7B")
-            .replace("}", "%7D")
-        )
+    def local_capabilities_url(
+        self, url: str, key: Optional[str] = None, layer: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Kodet url=...-verdi som peker på en lokal, fersk kopi av
+        capabilities-dokumentet, eller None (bruk tjenestens URL).
+        Med layer brukes kopien bare hvis den faktisk beskriver laget.
+        """
+        key = key or capabilities_key(url)
+        try:
+            local = cached_capabilities(url, key)
+            if local and layer and not capabilities_has_layer(local, layer):
+                local = None
+        except Exception:
+            local = None
+        if not local:
+            return None
 
-        zmin = int(variant.get("zmin", 0))
-        zmax = int(variant.get("zmax", 21))
+        return self.encode_url_for_qgis_uri(QUrl.fromLocalFile(local).toString())
 
-        uri = f"type=xyz&url={url_enc}&zmin={zmin}&zmax={zmax}&crs=EPSG3857"
-        title = variant.get("title") or variant.get("label") or "XYZ"
+    # url -> capabilities_key for alle varianter; samme liste hver gang
+    _cap_prefetch_keys: Optional[Dict[str, str]] = None
+
+    def _prefetch_capabilities(self):
+        # Hent capabilities mens brukeren velger i dialogen. Mange varianter
+        # deler dokument (f.eks. cache.kartverket.no), så én henting per URL.
+        cls = type(self)
+        if cls._cap_prefetch_keys is None:
+            cls._cap_prefetch_keys = {
+                (v["capabilities"] if v["type"] == "wmts" else v["url"]): v["_cap_key"]
+                for v in iter_variants(self.SERVICES)
+                if "_cap_key" in v
+            }
+        try:
+            prefetch_capabilities(cls._cap_prefetch_keys)
+        except Exception:
+            pass
 
+    def _capabilities_uri(self, variant: Dict, url: str) -> str:
+        local = self.local_capabilities_url(url, variant["_cap_key"], variant["_cap_layer"])
+        if local is None:
+            return variant["_uri"]
+        return f"{variant['_uri_params']}&url={local}"
+
+    # -------------------------
+    # Create XYZ layer
+    # -------------------------
+    def create_xyz_layer(self, variant: Dict, title: Optional[str] = None) -> QgsRasterLayer:
+        uri = variant["_uri"]
+        title = title or variant.get("label") or "XYZ"
         rl = QgsRasterLayer(uri, title, "wms")
         if not rl.isValid():
             raise RuntimeError(f"Klarte ikke å opprette XYZ-lag.\n\nURI:\n{uri}")
 
-        QgsProject.instance().addMapLayer(rl, False)
         return rl
 
     # -------------------------
-    # Add WMTS layer (via GetCapabilities)
+    # Create WMTS layer (via GetCapabilities)
     # -------------------------
-    def add_wmts_layer(self, variant: Dict) -> QgsRasterLayer:
+    def create_wmts_layer(self, variant: Dict, title: Optional[str] = None) -> QgsRasterLayer:
         cap = variant["capabilities"]
-        cap_enc = self.encode_url_for_qgis_uri(cap)
-
-        crs = variant.get("crs", "EPSG:25833")
-        fmt = variant.get("format", "image/png")
-        layer = variant["layer"]
-        style = variant.get("style", "default")
-        tms = variant["tileMatrixSet"]
-
-        uri = (
-            f"crs={crs}"
-            f"&format={fmt}"
-            f"&layers={layer}"
-            f"&styles={style}"
-            f"&tileMatrixSet={tms}"
-            f"&url={cap_enc}"
-        )
+        uri = self._capabilities_uri(variant, cap)
 
-        title = variant.get("title") or variant.get("label") or "WMTS"
+        title = title or variant.get("label") or "WMTS"
         rl = QgsRasterLayer(uri, title, "wms")
         if not rl.isValid():
             raise RuntimeError(
@@ -1428,33 +2016,16 @@ class BakgrunnskartPlugin:
                 f"Capabilities:\n{cap}\n\nURI:\n{uri}"
             )
 
-        QgsProject.instance().addMapLayer(rl, False)
         return rl
 
     # -------------------------
-    # Add WMS layer
+    # Create WMS layer
     # -------------------------
-    def add_wms_layer(self, variant: Dict) -> QgsRasterLayer:
+    def create_wms_layer(self, variant: Dict, title: Optional[str] = None) -> QgsRasterLayer:
         url = variant["url"]
-        url_enc = self.encode_url_for_qgis_uri(url)
-
-        crs = variant.get("crs", "EPSG:25833")
-        fmt = variant.get("format", "image/png")
-        layers = variant.get("layers") or variant.get("layer")
-        styles = variant.get("styles", "")
-
-        if not layers:
-            raise RuntimeError("WMS-variant mangler 'layers' (eller 'layer').")
-
-        uri = (
-            f"crs={crs}"
-            f"&format={fmt}"
-            f"&layers={layers}"
-            f"&styles={styles}"
-            f"&url={url_enc}"
-        )
+        uri = self._capabilities_uri(variant, url)
 
-        title = variant.get("title") or variant.get("label") or "WMS"
+        title = title or variant.get("label") or "WMS"
         rl = QgsRasterLayer(uri, title, "wms")
         if not rl.isValid():
             raise RuntimeError(
@@ -1462,47 +2033,23 @@ class BakgrunnskartPlugin:
                 f"URL:\n{url}\n\nURI:\n{uri}"
             )
 
-        QgsProject.instance().addMapLayer(rl, False)
         return rl
 
     # -------------------------
-    # Add Vector Tile layer (ArcGIS VectorTileServer / MVT)
+    # Create Vector Tile layer (ArcGIS VectorTileServer / MVT)
     # -------------------------
-    def add_vectortile_layer(self, variant: Dict):
-        if QgsVectorTileLayer is None:
+    def create_vectortile_layer(self, variant: Dict, title: Optional[str] = None):
+        vt_layer_cls = _vt_layer_cls()
+        if vt_layer_cls is None:
             raise RuntimeError("Denne QGIS-versjonen har ikke QgsVectorTileLayer tilgjengelig.")
 
-        title = variant.get("title") or variant.get("label") or "Vector tiles"
-
-        # Du kan enten oppgi ferdig 'uri' i variant,
-        # eller bruke style_url + url/service_url for å bygge.
-        uri = variant.get("uri")
-        if not uri:
-            service_url = variant.get("url") or variant.get("service_url")
-            style_url = variant.get("style_url") or variant.get("styleUrl")
-            zmin = int(variant.get("zmin", 0))
-            zmax = int(variant.get("zmax", 14))
-            if not service_url or not style_url:
-                raise RuntimeError(
-                    "Vector tile-variant mangler 'uri' eller (service_url/url + style_url/styleUrl)."
-                )
-
-            # ArcGIS VectorTileServer (slik QGIS normalt lagrer det)
-            uri = (
-                f"serviceType=arcgis"
-                f"&styleUrl={style_url}"
-                f"&type=xyz"
-                f"&url={service_url}"
-                f"&zmin={zmin}"
-                f"&zmax={zmax}"
-            )
-
+        uri = variant["_uri"]
+        title = title or variant.get("label") or "Vector tiles"
         provider = variant.get("provider", "arcgisvectortileservice")
-        lyr = QgsVectorTileLayer(uri, title, provider)
+        lyr = vt_layer_cls(uri, title, provider)
         if not lyr.isValid():
             raise RuntimeError(f"Klarte ikke å opprette Vector tile-lag.\n\nURI:\n{uri}")
 
-        QgsProject.instance().addMapLayer(lyr, False)
         return lyr
 
     # -------------------------
@@ -1510,62 +2057,92 @@ class BakgrunnskartPlugin:
     # -------------------------
     def run(self):
         plugin_dir = os.path.dirname(__file__)
-
-        dlg = ServicePickerDialog(
-            self.iface.mainWindow(),
-            self.SERVICES,
-            plugin_dir,
-            icon_size=self.PREVIEW_ICON_SIZE,
-        )
+        try:
+            self._load_services()
+        except (OSError, ValueError) as e:
+            # services.json mangler / er ugyldig – vis feilen, prøv igjen neste gang
+            QMessageBox.critical(self.iface.mainWindow(), "Bakgrunnskart", str(e))
+            return
+        self._build_search_index()
+
+        # Dialogen gjenbrukes: widgets, modell og ikoner bygges bare første gang
+        dlg = self._dlg
+        if dlg is None:
+            dlg = self._dlg = ServicePickerDialog(
+                self.iface.mainWindow(),
+                self.SERVICES,
+                plugin_dir,
+                icon_size=self.PREVIEW_ICON_SIZE,
+            )
+        else:
+            dlg.reset_selection()
+        self._prefetch_capabilities()
         if dlg.exec() != dialog_accepted_code():
             return
 
-
         service, type_key, variant = dlg.get_selection()
         if not service or not type_key or not variant:
             return
 
-        main_group = self.get_or_create_main_group()
+        from qgis.PyQt.QtWidgets import QProgressDialog  # brukes bare her
 
         progress = QProgressDialog("Legger til lag…", "Avbryt", 0, 0, self.iface.mainWindow())
         progress.setWindowTitle("Bakgrunnskart")
         progress.setMinimumDuration(0)
         progress.show()
-        QApplication.processEvents()
 
-        try:
-            vtype = (variant.get("type") or "").lower()
-
-            layer_title = f"{service.get('name', 'Bakgrunnskart')} [{type_key.upper()}] ({variant.get('label', 'variant')})"
-            variant = dict(variant)  # kopi
-            variant["title"] = layer_title
-
-            if vtype == "wmts":
-                rl = self.add_wmts_layer(variant)
-                main_group.addLayer(rl)
-
-            elif vtype == "xyz":
-                rl = self.add_xyz_layer(variant)
-                main_group.addLayer(rl)
+        # Selve laget lages i neste runde i event-loopen, så progress-dialogen
+        # rekker å tegnes uten at vi pumper events selv (processEvents)
+        QTimer.singleShot(0, functools.partial(self._do_add_layer, service, type_key, variant, progress))
+
+    def _do_add_layer(self, service: Dict, type_key: str, variant: Dict, progress):
+        vtype = (variant.get("type") or "").lower()
+        create_layer = self._dispatch.get(vtype)
+        if create_layer is None:
+            self._on_layer_failed(
+                progress,
+                "Ukjent variant-type.\n\n"
+                "Bruk 'wmts', 'wms', 'xyz' (og evt. 'vectortile' hvis du aktiverer det).",
+            )
+            return
 
-            elif vtype == "wms":
-                rl = self.add_wms_layer(variant)
-                main_group.addLayer(rl)
+        title = f"{service.get('name', 'Bakgrunnskart')} [{type_key.upper()}] ({variant.get('label', 'variant')})"
+        create = functools.partial(create_layer, variant, title)
 
-            elif vtype in ("vectortile", "vt", "mvt", "arcgis_vt"):
-                lyr = self.add_vectortile_layer(variant)
-                main_group.addLayer(lyr)
+        if vtype == "xyz":
+            # XYZ valideres uten nettverk: ingen grunn til å gå via en tråd
+            try:
+                layer = create()
+            except Exception as e:
+                self._on_layer_failed(progress, str(e))
+                return
+            self._on_layer_ready(progress, layer)
+            return
 
-            else:
-                raise RuntimeError(
-                    "Ukjent variant-type.\n\n"
-                    "Bruk 'wmts', 'wms', 'xyz' (og evt. 'vectortile' hvis du aktiverer det)."
-                )
+        # WMS/WMTS/vector tiles kan hente capabilities/stil over nett ved
+        # validering: lag dem i en tråd, progress-dialogen lever videre imens
+        signals = _LayerSignals(progress)
+        signals.finished.connect(functools.partial(self._on_layer_ready, progress))
+        signals.failed.connect(functools.partial(self._on_layer_failed, progress))
+        self._layer_pool.start(LayerLoader(create, signals))
 
-        except Exception as e:
-            QMessageBox.critical(self.iface.mainWindow(), "Bakgrunnskart", str(e))
-        finally:
-            try:
-                progress.close()
-            except Exception:
-                pass
\ No newline at end of file
+    @staticmethod
+    def _close_progress(progress):
+        try:
+            progress.close()
+            progress.deleteLater()
+        except Exception:
+            pass
+
+    def _on_layer_ready(self, progress, layer):
+        cancelled = progress.wasCanceled()
+        self._close_progress(progress)
+        if cancelled:
+            return  # laget er ikke lagt i prosjektet og ryddes av Python
+
+        QgsProject.instance().addMapLayer(layer, False)
+        self.get_or_create_main_group().addLayer(layer)
+
+    def _on_layer_failed(self, progress, message: str):
+        self._close_progress(progress)
+        QMessageBox.critical(self.iface.mainWindow(), "Bakgrunnskart", message)
\ No newline at end of file